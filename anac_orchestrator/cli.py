@@ -7,24 +7,108 @@ Gestisce migrazioni schema, discovery dataset e pipeline ETL
 import argparse
 import sys
 import logging
+import logging.handlers
 from pathlib import Path
 
-from .migration import MigrationManager
-from .discovery import DatasetDiscovery
-from .ingest import IngestPipeline
 from .config import Config
 
+# Command modules are imported inside the handlers so that a CLI call only
+# pays for (and requires the dependencies of) the command it runs.
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
 def setup_logging(level=logging.INFO):
     """Setup logging configuration"""
+    # The log file is only opened on the first record, and records are
+    # buffered until a warning arrives, the buffer fills, or logging shuts down.
+    file_handler = logging.FileHandler('anac_etl.log', delay=True)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    memory_handler = logging.handlers.MemoryHandler(
+        capacity=10000,
+        flushLevel=logging.WARNING,
+        target=file_handler
+    )
+    
     logging.basicConfig(
         level=level,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        format=LOG_FORMAT,
         handlers=[
             logging.StreamHandler(sys.stdout),
-            logging.FileHandler('anac_etl.log')
+            memory_handler
         ]
     )
 
+def _handle_migrate(args, config: Config, command_parser):
+    """Dispatch 'migrate' actions"""
+    from .migration import MigrationManager
+    
+    migration_manager = MigrationManager(config)
+    if args.migrate_action == 'up':
+        migration_manager.migrate_up()
+    elif args.migrate_action == 'status':
+        migration_manager.show_status()
+    else:
+        command_parser.print_help()
+
+def _handle_discover(args, config: Config, command_parser):
+    """Dispatch 'discover'"""
+    from .discovery import DatasetDiscovery
+    
+    DatasetDiscovery(config).discover_datasets()
+
+def _handle_registry(args, config: Config, command_parser):
+    """Dispatch 'registry' actions"""
+    from .discovery import DatasetDiscovery
+    
+    if args.registry_action == 'export':
+        DatasetDiscovery(config).export_registry()
+    else:
+        command_parser.print_help()
+
+def _handle_ingest(args, config: Config, command_parser):
+    """Dispatch 'ingest' actions"""
+    from .ingest import IngestPipeline
+    
+    if args.ingest_action is None:
+        command_parser.print_help()
+        return
+    
+    ingest_pipeline = IngestPipeline(config)
+    if args.ingest_action == 'convert':
+        ingest_pipeline.convert_json_to_ndjson(
+            dataset=args.dataset,
+            since=args.since,
+            all_datasets=args.all
+        )
+    elif args.ingest_action == 'load':
+        ingest_pipeline.load_ndjson_to_staging(
+            dataset=args.dataset,
+            since=args.since,
+            all_datasets=args.all
+        )
+    elif args.ingest_action == 'upsert':
+        ingest_pipeline.upsert_staging_to_core(
+            dataset=args.dataset,
+            since=args.since,
+            all_datasets=args.all
+        )
+    elif args.ingest_action == 'run':
+        ingest_pipeline.run_full_pipeline(
+            since=args.since,
+            all_datasets=args.all
+        )
+    elif args.ingest_action == 'status':
+        ingest_pipeline.show_status()
+    elif args.ingest_action == 'dry-run':
+        ingest_pipeline.dry_run()
+
+HANDLERS = {
+    'migrate': _handle_migrate,
+    'discover': _handle_discover,
+    'registry': _handle_registry,
+    'ingest': _handle_ingest,
+}
+
 def main():
     """Main CLI entry point"""
     parser = argparse.ArgumentParser(
@@ -86,61 +170,14 @@ def main():
     
     try:
         config = Config()
+        command_parsers = {
+            'migrate': migrate_parser,
+            'discover': discover_parser,
+            'registry': registry_parser,
+            'ingest': ingest_parser,
+        }
+        HANDLERS[args.command](args, config, command_parsers[args.command])
         
-        if args.command == 'migrate':
-            migration_manager = MigrationManager(config)
-            if args.migrate_action == 'up':
-                migration_manager.migrate_up()
-            elif args.migrate_action == 'status':
-                migration_manager.show_status()
-            else:
-                migrate_parser.print_help()
-                
-        elif args.command == 'discover':
-            discovery = DatasetDiscovery(config)
-            discovery.discover_datasets()
-            
-        elif args.command == 'registry':
-            discovery = DatasetDiscovery(config)
-            if args.registry_action == 'export':
-                discovery.export_registry()
-            else:
-                registry_parser.print_help()
-                
-        elif args.command == 'ingest':
-            ingest_pipeline = IngestPipeline(config)
-            if args.ingest_action == 'convert':
-                ingest_pipeline.convert_json_to_ndjson(
-                    dataset=args.dataset,
-                    since=args.since,
-                    all_datasets=args.all
-                )
-            elif args.ingest_action == 'load':
-                ingest_pipeline.load_ndjson_to_staging(
-                    dataset=args.dataset,
-                    since=args.since,
-                    all_datasets=args.all
-                )
-            elif args.ingest_action == 'upsert':
-                ingest_pipeline.upsert_staging_to_core(
-                    dataset=args.dataset,
-                    since=args.since,
-                    all_datasets=args.all
-                )
-            elif args.ingest_action == 'run':
-                ingest_pipeline.run_full_pipeline(
-                    since=args.since,
-                    all_datasets=args.all
-                )
-            elif args.ingest_action == 'status':
-                ingest_pipeline.show_status()
-            elif args.ingest_action == 'dry-run':
-                ingest_pipeline.dry_run()
-            else:
-                ingest_parser.print_help()
-        else:
-            parser.print_help()
-            
     except Exception as e:
         logger.error(f"Error executing command: {e}")
         return 1
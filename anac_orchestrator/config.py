@@ -2,17 +2,112 @@
 Configuration management for ANAC Orchestrator
 """
 
+import copy
+import json
+import logging
 import os
+import stat
+import tempfile
 import yaml
 from pathlib import Path
 from typing import Dict, Any, Optional
 
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Parsed config files keyed by path: (mtime_ns, size, data)
+_CONFIG_CACHE: Dict[str, tuple] = {}
+
+def _parse_json(raw: bytes) -> Dict[str, Any]:
+    """Parse JSON config bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def _dump_json(data: Dict[str, Any]) -> bytes:
+    """Serialize config to indented JSON bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2, ensure_ascii=False, default=str).encode('utf-8')
+
+def _parse_yaml(raw: bytes) -> Dict[str, Any]:
+    """Parse YAML config bytes"""
+    return yaml.load(raw, Loader=_Loader)
+
+def _mtime_ns(path: str) -> Optional[int]:
+    """Modification time of path in nanoseconds, or None if it does not exist"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _ensure_dir(raw_path: str) -> Path:
+    """Return raw_path as a Path, creating the directory if needed"""
+    path = Path(raw_path)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def _atomic_write(path: str, data: bytes):
+    """Write bytes to path via a uniquely named temporary file, fsync and os.replace
+    
+    The unique name lets concurrent processes rewrite the same file safely
+    (the last replace wins). An existing file keeps its permissions.
+    """
+    directory, name = os.path.split(path)
+    with tempfile.NamedTemporaryFile('wb', buffering=1 << 20, dir=directory or '.',
+                                     prefix=f"{name}.", suffix='.tmp', delete=False) as f:
+        tmp_path = f.name
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.close()
+            os.unlink(tmp_path)
+            raise
+    try:
+        os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+    except FileNotFoundError:
+        pass
+    os.replace(tmp_path, path)
+
 class Config:
-    """Configuration manager for ANAC Orchestrator"""
+    """Configuration manager for ANAC Orchestrator
+    
+    Pickling ships only the config path and the scalar settings; the
+    config document itself is reloaded (via the parse cache) on unpickle,
+    so unsaved changes to ``config`` do not travel to worker processes.
+    """
+    
+    __slots__ = (
+        'config_path', 'json_config_path', 'config', '_version',
+        'db_host', 'db_port', 'db_name', 'db_user', 'db_password',
+        '_json_root_raw', '_ndjson_root_raw', '_logs_root_raw', '_cache_root_raw',
+        '_json_root', '_ndjson_root', '_logs_root', '_cache_root', 'script_path'
+    )
+    
+    # Scalar settings carried across pickling
+    _PICKLED_FIELDS = (
+        'db_host', 'db_port', 'db_name', 'db_user', 'db_password',
+        '_json_root_raw', '_ndjson_root_raw', '_logs_root_raw', '_cache_root_raw', 'script_path'
+    )
     
     def __init__(self, config_path: Optional[str] = None):
         self.config_path = config_path or os.getenv('ANAC_CONFIG_PATH', 'config/anac_etl.yml')
+        # Canonical machine-written copy; the YAML file is only rewritten on export
+        self.json_config_path = os.path.splitext(self.config_path)[0] + '.json'
         self.config = self._load_config()
+        # Bumped on every mutation so callers can cache derived lookups
+        self._version = 0
         
         # Database configuration
         self.db_host = os.getenv('ANAC_DB_HOST', 'localhost')
@@ -21,29 +116,136 @@ class Config:
         self.db_user = os.getenv('ANAC_DB_USER', 'root')
         self.db_password = os.getenv('ANAC_DB_PASSWORD', '')
         
-        # Paths
-        self.json_root = Path(os.getenv('ANAC_JSON_ROOT', 'database/JSON'))
-        self.ndjson_root = Path(os.getenv('ANAC_NDJSON_ROOT', 'database/NDJSON'))
-        self.logs_root = Path(os.getenv('ANAC_LOGS_ROOT', 'database/logs'))
+        # Paths (directories are created on first access)
+        self._json_root_raw = os.getenv('ANAC_JSON_ROOT', 'database/JSON')
+        self._ndjson_root_raw = os.getenv('ANAC_NDJSON_ROOT', 'database/NDJSON')
+        self._logs_root_raw = os.getenv('ANAC_LOGS_ROOT', 'database/logs')
+        self._cache_root_raw = os.getenv('ANAC_CACHE_ROOT', 'database/cache')
+        self._json_root = self._ndjson_root = self._logs_root = self._cache_root = None
         self.script_path = Path(os.getenv('ANAC_SCRIPT_PATH', 'Script_creazioneDB_Anac.txt'))
+    
+    def __reduce__(self):
+        state = {field: getattr(self, field) for field in self._PICKLED_FIELDS}
+        return (Config, (self.config_path,), state)
+    
+    def __setstate__(self, state: Dict[str, Any]):
+        for field, value in state.items():
+            setattr(self, field, value)
+    
+    @property
+    def json_root(self) -> Path:
+        """JSON input root, created if missing"""
+        if self._json_root is None:
+            self._json_root = _ensure_dir(self._json_root_raw)
+        return self._json_root
+    
+    @json_root.setter
+    def json_root(self, value):
+        self._json_root_raw = str(value)
+        self._json_root = Path(value)
+    
+    @property
+    def ndjson_root(self) -> Path:
+        """NDJSON output root, created if missing"""
+        if self._ndjson_root is None:
+            self._ndjson_root = _ensure_dir(self._ndjson_root_raw)
+        return self._ndjson_root
+    
+    @ndjson_root.setter
+    def ndjson_root(self, value):
+        self._ndjson_root_raw = str(value)
+        self._ndjson_root = Path(value)
+    
+    @property
+    def logs_root(self) -> Path:
+        """Logs root, created if missing"""
+        if self._logs_root is None:
+            self._logs_root = _ensure_dir(self._logs_root_raw)
+        return self._logs_root
+    
+    @logs_root.setter
+    def logs_root(self, value):
+        self._logs_root_raw = str(value)
+        self._logs_root = Path(value)
+    
+    @property
+    def cache_root(self) -> Path:
+        """Cache root for reusable ETL state (e.g. file hashes), created if missing"""
+        if self._cache_root is None:
+            self._cache_root = _ensure_dir(self._cache_root_raw)
+        return self._cache_root
+    
+    @cache_root.setter
+    def cache_root(self, value):
+        self._cache_root_raw = str(value)
+        self._cache_root = Path(value)
+
+    def staging_file_key(self, path) -> str:
+        """Key of a staged file, independent of the cwd and of how the roots are spelled
+
+        The file's path relative to ndjson_root (or json_root, for JSON
+        streamed without an NDJSON copy) with a .ndjson suffix, so both
+        routes to the same data share one key. Files outside both roots
+        fall back to their absolute path.
+        """
+        path = Path(os.path.abspath(path))
+        for root in (self._ndjson_root_raw, self._json_root_raw):
+            try:
+                return path.relative_to(os.path.abspath(root)).with_suffix('.ndjson').as_posix()
+            except ValueError:
+                continue
+        return path.as_posix()
+
+    def _load_config(self) -> Dict[str, Any]:
+        """Load configuration, preferring the JSON copy over the YAML file
         
-        # Ensure directories exist
-        self.json_root.mkdir(parents=True, exist_ok=True)
-        self.ndjson_root.mkdir(parents=True, exist_ok=True)
-        self.logs_root.mkdir(parents=True, exist_ok=True)
+        A YAML file modified after the JSON copy was written is loaded
+        instead (with a warning), so hand edits to it are not ignored.
+        """
+        sources = [(self.json_config_path, _parse_json), (self.config_path, _parse_yaml)]
+        json_mtime = _mtime_ns(self.json_config_path)
+        yaml_mtime = _mtime_ns(self.config_path)
+        if json_mtime is not None and yaml_mtime is not None and yaml_mtime > json_mtime:
+            logger.warning(f"{self.config_path} is newer than {self.json_config_path}, loading the YAML file")
+            sources.reverse()
         
-    def _load_config(self) -> Dict[str, Any]:
-        """Load configuration from YAML file"""
-        if os.path.exists(self.config_path):
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                return yaml.safe_load(f) or {}
+        for path, parse in sources:
+            try:
+                return self._load_cached(path, parse)
+            except FileNotFoundError:
+                continue
         return {}
     
+    def _load_cached(self, path: str, parse) -> Dict[str, Any]:
+        """Parse a config file, reusing the cached result if it is unchanged"""
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            cached = _CONFIG_CACHE.get(path)
+            if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+                return copy.deepcopy(cached[2])
+            
+            data = parse(f.read()) or {}
+        _CONFIG_CACHE[path] = (st.st_mtime_ns, st.st_size, data)
+        return copy.deepcopy(data)
+    
     def save_config(self):
-        """Save current configuration to YAML file"""
+        """Save current configuration to the JSON config file"""
+        self._version += 1
+        _CONFIG_CACHE.pop(self.json_config_path, None)
+        os.makedirs(os.path.dirname(self.json_config_path), exist_ok=True)
+        _atomic_write(self.json_config_path, _dump_json(self.config))
+    
+    def save_yaml(self):
+        """Save current configuration to the YAML config file (and refresh the JSON copy)"""
+        _CONFIG_CACHE.pop(self.config_path, None)
         os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
-        with open(self.config_path, 'w', encoding='utf-8') as f:
-            yaml.dump(self.config, f, default_flow_style=False, allow_unicode=True)
+        data = yaml.dump(self.config, Dumper=_Dumper, default_flow_style=False,
+                         allow_unicode=True, encoding='utf-8')
+        _atomic_write(self.config_path, data)
+        
+        # Rewrite the JSON copy after the YAML, so it is not older than the file just exported
+        _CONFIG_CACHE.pop(self.json_config_path, None)
+        _atomic_write(self.json_config_path, _dump_json(self.config))
     
     def get_database_url(self) -> str:
         """Get database connection URL"""
@@ -56,4 +258,5 @@ class Config:
     def update_registry(self, registry: Dict[str, Any]):
         """Update dataset registry in config"""
         self.config['registry'] = registry
+        self._version += 1
         self.save_config()
@@ -0,0 +1,76 @@
+"""
+MySQL connection pooling for migrations and the ETL pipeline
+"""
+
+from typing import Dict, Any
+import pymysql
+from pymysql.constants import CLIENT
+
+try:
+    from dbutils.pooled_db import PooledDB
+except ImportError:
+    PooledDB = None
+
+from .config import Config
+
+# Connection pools shared in this process, keyed by connection parameters
+_POOLS: Dict[tuple, Any] = {}
+
+def connection_kwargs(config: Config, local_infile: bool = False,
+                      multi_statements: bool = False) -> Dict[str, Any]:
+    """Build pymysql connection arguments from config
+    
+    LOAD DATA LOCAL INFILE and multi-statement batches are enabled only
+    when asked for (ETL staging loads and migration scripts respectively),
+    so connections running interpolated SQL never get either capability.
+    """
+    kwargs = {
+        'host': config.db_host,
+        'port': config.db_port,
+        'user': config.db_user,
+        'password': config.db_password,
+        'database': config.db_name,
+        'charset': 'utf8mb4',
+        'autocommit': False,
+        'local_infile': local_infile
+    }
+    if multi_statements:
+        kwargs['client_flag'] = CLIENT.MULTI_STATEMENTS
+    return kwargs
+
+def get_pool(config: Config, local_infile: bool = False, multi_statements: bool = False):
+    """Get (or create) the connection pool for config, or None without DBUtils
+    
+    Pools are keyed by connection arguments, so each capability set gets
+    its own pool.
+    """
+    if PooledDB is None:
+        return None
+    
+    kwargs = connection_kwargs(config, local_infile, multi_statements)
+    key = tuple(sorted(kwargs.items()))
+    pool = _POOLS.get(key)
+    if pool is None:
+        pool_size = config.config.get('etl', {}).get('db_pool_size', 8)
+        pool = PooledDB(
+            creator=pymysql,
+            mincached=min(2, pool_size),
+            maxcached=pool_size,
+            maxshared=0,
+            maxconnections=pool_size,
+            blocking=True,
+            ping=1,
+            **kwargs
+        )
+        _POOLS[key] = pool
+    return pool
+
+def connect(config: Config, local_infile: bool = False, multi_statements: bool = False):
+    """Get a connection from the shared pool, or a new one without DBUtils
+    
+    Closing a pooled connection returns it to the pool.
+    """
+    pool = get_pool(config, local_infile, multi_statements)
+    if pool is not None:
+        return pool.connection()
+    return pymysql.connect(**connection_kwargs(config, local_infile, multi_statements))
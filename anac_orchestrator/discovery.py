@@ -2,302 +2,456 @@
 Dataset discovery and registry management for ANAC Orchestrator
 """
 
+import hashlib
 import logging
-import re
-from pathlib import Path
-from typing import Dict, List, Any, Optional
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Dict, List, Any, NamedTuple, Optional, Tuple
 import yaml
 
 from .config import Config
 
 logger = logging.getLogger(__name__)
 
+# Above this many candidate folders, directory checks run in a thread pool
+_PARALLEL_STAT_THRESHOLD = 64
+_STAT_WORKERS = 32
+
+class UnknownDataset(NamedTuple):
+    """Dataset folder found during discovery with no predefined mapping"""
+    name: str
+    folder: str
+    path: str
+
+def _classify_dataset_folder(name: str) -> Optional[Tuple[str, bool]]:
+    """Classify a YYYYMMDD-<dataset>_json folder name
+
+    Returns (dataset_name, is_predefined), or None if the name does not
+    follow the pattern. Predefined datasets are matched on the suffix of
+    their folder_glob, so one dict probe decides known vs unknown.
+    """
+    if len(name) > 14 and name[8] == '-' and name.endswith('_json') and name[:8].isdecimal():
+        known = _SUFFIX_TO_NAME.get(name[8:])
+        if known:
+            return known, True
+        return name[9:-5], False
+    return None
+
+def _check_dirs(candidates: List[tuple]) -> List[bool]:
+    """Run is_dir() on scandir candidates, in parallel when there are many
+
+    DirEntry.is_dir() is free when the filesystem reports the entry type,
+    but falls back to a stat() call (e.g. on NFS) that threads can overlap.
+    """
+    if len(candidates) < _PARALLEL_STAT_THRESHOLD:
+        return [candidate[0].is_dir() for candidate in candidates]
+    
+    with ThreadPoolExecutor(max_workers=_STAT_WORKERS) as executor:
+        return list(executor.map(lambda candidate: candidate[0].is_dir(), candidates))
+
+def _topological_levels(dependencies: Dict[str, List[str]]) -> Tuple[Tuple[str, ...], ...]:
+    """Group datasets into dependency levels (parents first) with Kahn's algorithm
+
+    Dependencies outside the mapping are ignored. Datasets caught in a
+    cycle are returned together as a final level.
+    """
+    indegree = {name: 0 for name in dependencies}
+    dependents: Dict[str, List[str]] = {name: [] for name in dependencies}
+    for name, depends_on in dependencies.items():
+        for dep in set(depends_on):
+            if dep in dependencies:
+                indegree[name] += 1
+                dependents[dep].append(name)
+    
+    levels = []
+    ready = [name for name, degree in indegree.items() if degree == 0]
+    while ready:
+        levels.append(tuple(ready))
+        next_ready = []
+        for name in ready:
+            for child in dependents[name]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    next_ready.append(child)
+        ready = next_ready
+    
+    remaining = tuple(name for name, degree in indegree.items() if degree > 0)
+    if remaining:
+        levels.append(remaining)
+    return tuple(levels)
+
+# Column types whose CAST target MySQL spells differently (CAST has no INT target)
+_CAST_TARGETS = {'INT': 'SIGNED'}
+
+def _json_col(field: str, cast: Optional[str] = None) -> str:
+    """Build the SQL expression extracting a payload field, optionally CAST to a column type"""
+    expr = f'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.{field}"))'
+    return f'CAST({expr} AS {_CAST_TARGETS.get(cast, cast)})' if cast else expr
+
+def _json_date(field: str) -> str:
+    """Build the SQL expression parsing a YYYY-MM-DD payload field as DATE"""
+    return f'STR_TO_DATE({_json_col(field)}, "%Y-%m-%d")'
+
+# Predefined dataset mappings based on the real ANAC structure
+_PREDEFINED_DATASETS = {
+    'cig': {
+        'name': 'cig',
+        'folder_glob': '*-cig_json',
+        'json_pointer': 'item',
+        'core_table': 'bando_cig',
+        'stg_json_table': 'stg_cig_json',
+        'stg_table': 'stg_cig',
+        'key': 'cig',
+        'depends_on': [],
+        'select_map': {
+            'cig': _json_col('cig'),
+            'cf_amministrazione_appaltante': _json_col('cf_amministrazione_appaltante'),
+            'denominazione_amministrazione_appaltante': _json_col('denominazione_amministrazione_appaltante'),
+            'oggetto_gara': _json_col('oggetto_gara'),
+            'importo_complessivo_gara': _json_col('importo_complessivo_gara', 'DOUBLE'),
+            'data_pubblicazione': _json_date('data_pubblicazione'),
+            'data_scadenza_offerta': _json_date('data_scadenza_offerta')
+        },
+        'upsert_update_fields': ['cf_amministrazione_appaltante', 'denominazione_amministrazione_appaltante', 'oggetto_gara', 'importo_complessivo_gara', 'data_pubblicazione', 'data_scadenza_offerta']
+    },
+    'aggiudicazioni': {
+        'name': 'aggiudicazioni',
+        'folder_glob': '*-aggiudicazioni_json',
+        'json_pointer': 'item',
+        'core_table': 'aggiudicazioni',
+        'stg_json_table': 'stg_aggiudicazioni_json',
+        'stg_table': 'stg_aggiudicazioni',
+        'key': 'id_aggiudicazione',
+        'depends_on': ['cig'],
+        'select_map': {
+            'id_aggiudicazione': _json_col('id_aggiudicazione', 'INT'),
+            'cig': _json_col('cig'),
+            'importo_aggiudicazione': _json_col('importo_aggiudicazione', 'DOUBLE'),
+            'data_aggiudicazione_definitiva': _json_col('data_aggiudicazione_definitiva'),
+            'esito': _json_col('esito')
+        },
+        'upsert_update_fields': ['importo_aggiudicazione', 'data_aggiudicazione_definitiva', 'esito']
+    },
+    'aggiudicatari': {
+        'name': 'aggiudicatari',
+        'folder_glob': '*-aggiudicatari_json',
+        'json_pointer': 'item',
+        'core_table': 'aggiudicatari',
+        'stg_json_table': 'stg_aggiudicatari_json',
+        'stg_table': 'stg_aggiudicatari',
+        'key': 'codice_fiscale',
+        'depends_on': ['aggiudicazioni'],
+        'select_map': {
+            'codice_fiscale': _json_col('codice_fiscale'),
+            'cig': _json_col('cig'),
+            'ruolo': _json_col('ruolo'),
+            'denominazione': _json_col('denominazione'),
+            'tipo_soggetto': _json_col('tipo_soggetto'),
+            'id_aggiudicazioni': _json_col('id_aggiudicazioni', 'INT')
+        },
+        'upsert_update_fields': ['ruolo', 'denominazione', 'tipo_soggetto', 'id_aggiudicazioni']
+    },
+    'partecipanti': {
+        'name': 'partecipanti',
+        'folder_glob': '*-partecipanti_json',
+        'json_pointer': 'item',
+        'core_table': 'partecipanti',
+        'stg_json_table': 'stg_partecipanti_json',
+        'stg_table': 'stg_partecipanti',
+        'key': 'codice_fiscale',
+        'depends_on': ['cig'],
+        'select_map': {
+            'codice_fiscale': _json_col('codice_fiscale'),
+            'cig': _json_col('cig'),
+            'ruolo': _json_col('ruolo'),
+            'denominazione': _json_col('denominazione'),
+            'tipo_soggetto': _json_col('tipo_soggetto')
+        },
+        'upsert_update_fields': ['ruolo', 'denominazione', 'tipo_soggetto']
+    },
+    'cup': {
+        'name': 'cup',
+        'folder_glob': '*-cup_json',
+        'json_pointer': 'item',
+        'core_table': 'cup',
+        'stg_json_table': 'stg_cup_json',
+        'stg_table': 'stg_cup',
+        'key': 'cup',
+        'depends_on': ['cig'],
+        'select_map': {
+            'cup': _json_col('cup'),
+            'cig': _json_col('cig')
+        },
+        'upsert_update_fields': ['cig']
+    },
+    'stazioni_appaltanti': {
+        'name': 'stazioni_appaltanti',
+        'folder_glob': '*-stazioni-appaltanti_json',
+        'json_pointer': 'item',
+        'core_table': 'stazioni_appaltanti',
+        'stg_json_table': 'stg_stazioni_appaltanti_json',
+        'stg_table': 'stg_stazioni_appaltanti',
+        'key': 'codice_fiscale',
+        'depends_on': ['cig'],
+        'select_map': {
+            'codice_fiscale': _json_col('codice_fiscale'),
+            'denominazione': _json_col('denominazione'),
+            'cig': _json_col('cig')
+        },
+        'upsert_update_fields': ['denominazione', 'cig']
+    },
+    'categorie_opera': {
+        'name': 'categorie_opera',
+        'folder_glob': '*-categorie-opera_json',
+        'json_pointer': 'item',
+        'core_table': 'categorie_opera',
+        'stg_json_table': 'stg_categorie_opera_json',
+        'stg_table': 'stg_categorie_opera',
+        'key': 'id',
+        'depends_on': ['cig'],
+        'select_map': {
+            'cig': _json_col('cig'),
+            'id_categoria': _json_col('id_categoria'),
+            'descrizione': _json_col('descrizione'),
+            'cod_tipo_categoria': _json_col('cod_tipo_categoria')
+        },
+        'upsert_update_fields': ['id_categoria', 'descrizione', 'cod_tipo_categoria']
+    },
+    'categorie_dpcm_aggregazione': {
+        'name': 'categorie_dpcm_aggregazione',
+        'folder_glob': '*-categorie-dpcm-aggregazione_json',
+        'json_pointer': 'item',
+        'core_table': 'categorie_dpcm_aggregazione',
+        'stg_json_table': 'stg_categorie_dpcm_aggregazione_json',
+        'stg_table': 'stg_categorie_dpcm_aggregazione',
+        'key': 'id',
+        'depends_on': ['cig'],
+        'select_map': {
+            'id_categoria': _json_col('id_categoria'),
+            'descrizione': _json_col('descrizione'),
+            'cod_tipo_categoria': _json_col('cod_tipo_categoria'),
+            'cig': _json_col('cig')
+        },
+        'upsert_update_fields': ['id_categoria', 'descrizione', 'cod_tipo_categoria', 'cig']
+    },
+    'lavorazioni': {
+        'name': 'lavorazioni',
+        'folder_glob': '*-lavorazioni_json',
+        'json_pointer': 'item',
+        'core_table': 'lavorazioni',
+        'stg_json_table': 'stg_lavorazioni_json',
+        'stg_table': 'stg_lavorazioni',
+        'key': 'cod_tipo_lavorazione',
+        'depends_on': ['cig'],
+        'select_map': {
+            'cod_tipo_lavorazione': _json_col('cod_tipo_lavorazione', 'INT'),
+            'cig': _json_col('cig'),
+            'tipo_lavorazione': _json_col('tipo_lavorazione')
+        },
+        'upsert_update_fields': ['cig', 'tipo_lavorazione']
+    },
+    'subappalti': {
+        'name': 'subappalti',
+        'folder_glob': '*-subappalti_json',
+        'json_pointer': 'item',
+        'core_table': 'subappalti',
+        'stg_json_table': 'stg_subappalti_json',
+        'stg_table': 'stg_subappalti',
+        'key': 'id_subappalto',
+        'depends_on': ['aggiudicazioni'],
+        'select_map': {
+            'id_subappalto': _json_col('id_subappalto'),
+            'cig': _json_col('cig'),
+            'id_aggiudicazione': _json_col('id_aggiudicazione', 'INT')
+        },
+        'upsert_update_fields': ['cig', 'id_aggiudicazione']
+    },
+    'stati_avanzamento': {
+        'name': 'stati_avanzamento',
+        'folder_glob': '*-stati-avanzamento_json',
+        'json_pointer': 'item',
+        'core_table': 'stati_avanzamento',
+        'stg_json_table': 'stg_stati_avanzamento_json',
+        'stg_table': 'stg_stati_avanzamento',
+        'key': 'cig',
+        'depends_on': ['aggiudicazioni'],
+        'select_map': {
+            'cig': _json_col('cig'),
+            'id_aggiudicazione': _json_col('id_aggiudicazione', 'INT')
+        },
+        'upsert_update_fields': ['id_aggiudicazione']
+    },
+    'varianti': {
+        'name': 'varianti',
+        'folder_glob': '*-varianti_json',
+        'json_pointer': 'item',
+        'core_table': 'varianti',
+        'stg_json_table': 'stg_varianti_json',
+        'stg_table': 'stg_varianti',
+        'key': 'id_variante',
+        'depends_on': ['aggiudicazioni'],
+        'select_map': {
+            'id_variante': _json_col('id_variante'),
+            'id_aggiudicazione': _json_col('id_aggiudicazione', 'INT')
+        },
+        'upsert_update_fields': ['id_aggiudicazione']
+    },
+    'fine_contratto': {
+        'name': 'fine_contratto',
+        'folder_glob': '*-fine-contratto_json',
+        'json_pointer': 'item',
+        'core_table': 'fine_contratto',
+        'stg_json_table': 'stg_fine_contratto_json',
+        'stg_table': 'stg_fine_contratto',
+        'key': 'cig',
+        'depends_on': ['aggiudicazioni'],
+        'select_map': {
+            'cig': _json_col('cig'),
+            'id_aggiudicazione': _json_col('id_aggiudicazione', 'INT')
+        },
+        'upsert_update_fields': ['id_aggiudicazione']
+    },
+    'collaudo': {
+        'name': 'collaudo',
+        'folder_glob': '*-collaudo_json',
+        'json_pointer': 'item',
+        'core_table': 'collaudo',
+        'stg_json_table': 'stg_collaudo_json',
+        'stg_table': 'stg_collaudo',
+        'key': 'cig',
+        'depends_on': ['aggiudicazioni'],
+        'select_map': {
+            'cig': _json_col('cig'),
+            'id_aggiudicazione': _json_col('id_aggiudicazione', 'INT')
+        },
+        'upsert_update_fields': ['id_aggiudicazione']
+    },
+    'quadro_economico': {
+        'name': 'quadro_economico',
+        'folder_glob': '*-quadro-economico_json',
+        'json_pointer': 'item',
+        'core_table': 'quadro_economico',
+        'stg_json_table': 'stg_quadro_economico_json',
+        'stg_table': 'stg_quadro_economico',
+        'key': 'cig',
+        'depends_on': ['aggiudicazioni'],
+        'select_map': {
+            'cig': _json_col('cig'),
+            'id_aggiudicazione': _json_col('id_aggiudicazione', 'INT')
+        },
+        'upsert_update_fields': ['id_aggiudicazione']
+    },
+    'fonti_finanziamento': {
+        'name': 'fonti_finanziamento',
+        'folder_glob': '*-fonti-finanziamento_json',
+        'json_pointer': 'item',
+        'core_table': 'fonti_finanziamento',
+        'stg_json_table': 'stg_fonti_finanziamento_json',
+        'stg_table': 'stg_fonti_finanziamento',
+        'key': 'cig',
+        'depends_on': ['aggiudicazioni'],
+        'select_map': {
+            'cig': _json_col('cig'),
+            'id_aggiudicazione': _json_col('id_aggiudicazione', 'INT')
+        },
+        'upsert_update_fields': ['id_aggiudicazione']
+    },
+    'avvio_contratto': {
+        'name': 'avvio_contratto',
+        'folder_glob': '*-avvio-contratto_json',
+        'json_pointer': 'item',
+        'core_table': 'avvio_contratto',
+        'stg_json_table': 'stg_avvio_contratto_json',
+        'stg_table': 'stg_avvio_contratto',
+        'key': 'cig',
+        'depends_on': ['aggiudicazioni'],
+        'select_map': {
+            'cig': _json_col('cig'),
+            'id_aggiudicazione': _json_col('id_aggiudicazione', 'INT')
+        },
+        'upsert_update_fields': ['id_aggiudicazione']
+    }
+}
+
+# Columns indexed on the JSON staging table besides the dataset key
+_INDEXED_GENERATED_COLUMNS = ('cig',)
+# TEXT generated columns are indexed on this many leading characters
+_GENERATED_INDEX_PREFIX = 255
+
+def _generated_column_type(expression: str) -> str:
+    """Pick the SQL type of a STORED generated column from its select_map expression
+
+    Casts keep their type (integer casts, generated AS SIGNED, are stored
+    as INT like the core columns); uncast text stays TEXT, indexed on a
+    prefix, since a VARCHAR would silently truncate longer values under
+    the IGNORE implied by LOAD DATA LOCAL.
+    """
+    if expression.endswith(' AS DOUBLE)'):
+        return 'DOUBLE'
+    if expression.endswith(' AS SIGNED)'):
+        return 'INT'
+    if expression.startswith('STR_TO_DATE('):
+        return 'DATE'
+    return 'TEXT'
+
+def _generated_columns(dataset_config: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Build the generated_columns spec ({column: [expression, sql_type]})
+
+    Materializing the select_map expressions as STORED generated columns
+    on stg_<dataset>_json parses the JSON payload once per row at load
+    time, so the projection to the typed staging table reads plain columns.
+    """
+    return {
+        column: [expression, _generated_column_type(expression)]
+        for column, expression in dataset_config['select_map'].items()
+    }
+
+def _generated_column_comment(expression: str, sql_type: str) -> str:
+    """COMMENT tagging a generated column with a digest of its definition
+
+    MySQL normalizes stored generation expressions, so the digest is what
+    tells a column built from an older select_map apart.
+    """
+    digest = hashlib.sha256(f"{sql_type} {expression}".encode('utf-8')).hexdigest()[:16]
+    return f"select_map:{digest}"
+
+for _dataset_config in _PREDEFINED_DATASETS.values():
+    _dataset_config['generated_columns'] = _generated_columns(_dataset_config)
+
+# Shared read-only views: discovery overlays 'last_seen' on a fresh dict instead
+_PREDEFINED_DATASETS = {
+    name: MappingProxyType(dataset_config)
+    for name, dataset_config in _PREDEFINED_DATASETS.items()
+}
+
+# Folder name suffix ('-<dataset>_json', from folder_glob) -> dataset name
+_SUFFIX_TO_NAME = {
+    sys.intern(dataset_config['folder_glob'].lstrip('*')): sys.intern(name)
+    for name, dataset_config in _PREDEFINED_DATASETS.items()
+}
+
+# Fields every registry dataset entry must define
+_REQUIRED_FIELDS = ('name', 'core_table', 'stg_table', 'key', 'select_map')
+
+# Dependency order of the predefined datasets, computed once at import
+_LEVELS = _topological_levels({
+    name: dataset_config['depends_on'] for name, dataset_config in _PREDEFINED_DATASETS.items()
+})
+_ORDER = tuple(name for level in _LEVELS for name in level)
+
 class DatasetDiscovery:
     """Manages dataset discovery and registry generation"""
     
+    ORDER = _ORDER
+    
     def __init__(self, config: Config):
         self.config = config
-        
-        # Predefined dataset mappings based on the real ANAC structure
-        self.predefined_datasets = {
-            'cig': {
-                'name': 'cig',
-                'folder_glob': '*-cig_json',
-                'json_pointer': 'item',
-                'core_table': 'bando_cig',
-                'stg_json_table': 'stg_cig_json',
-                'stg_table': 'stg_cig',
-                'key': 'cig',
-                'depends_on': [],
-                'select_map': {
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'cf_amministrazione_appaltante': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cf_amministrazione_appaltante"))',
-                    'denominazione_amministrazione_appaltante': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.denominazione_amministrazione_appaltante"))',
-                    'oggetto_gara': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.oggetto_gara"))',
-                    'importo_complessivo_gara': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.importo_complessivo_gara")) AS DOUBLE)',
-                    'data_pubblicazione': 'STR_TO_DATE(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.data_pubblicazione")), "%Y-%m-%d")',
-                    'data_scadenza_offerta': 'STR_TO_DATE(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.data_scadenza_offerta")), "%Y-%m-%d")'
-                },
-                'upsert_update_fields': ['cf_amministrazione_appaltante', 'denominazione_amministrazione_appaltante', 'oggetto_gara', 'importo_complessivo_gara', 'data_pubblicazione', 'data_scadenza_offerta']
-            },
-            'aggiudicazioni': {
-                'name': 'aggiudicazioni',
-                'folder_glob': '*-aggiudicazioni_json',
-                'json_pointer': 'item',
-                'core_table': 'aggiudicazioni',
-                'stg_json_table': 'stg_aggiudicazioni_json',
-                'stg_table': 'stg_aggiudicazioni',
-                'key': 'id_aggiudicazione',
-                'depends_on': ['cig'],
-                'select_map': {
-                    'id_aggiudicazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_aggiudicazione")) AS INT)',
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'importo_aggiudicazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.importo_aggiudicazione")) AS DOUBLE)',
-                    'data_aggiudicazione_definitiva': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.data_aggiudicazione_definitiva"))',
-                    'esito': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.esito"))'
-                },
-                'upsert_update_fields': ['importo_aggiudicazione', 'data_aggiudicazione_definitiva', 'esito']
-            },
-            'aggiudicatari': {
-                'name': 'aggiudicatari',
-                'folder_glob': '*-aggiudicatari_json',
-                'json_pointer': 'item',
-                'core_table': 'aggiudicatari',
-                'stg_json_table': 'stg_aggiudicatari_json',
-                'stg_table': 'stg_aggiudicatari',
-                'key': 'codice_fiscale',
-                'depends_on': ['aggiudicazioni'],
-                'select_map': {
-                    'codice_fiscale': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.codice_fiscale"))',
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'ruolo': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.ruolo"))',
-                    'denominazione': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.denominazione"))',
-                    'tipo_soggetto': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.tipo_soggetto"))',
-                    'id_aggiudicazioni': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_aggiudicazioni")) AS INT)'
-                },
-                'upsert_update_fields': ['ruolo', 'denominazione', 'tipo_soggetto', 'id_aggiudicazioni']
-            },
-            'partecipanti': {
-                'name': 'partecipanti',
-                'folder_glob': '*-partecipanti_json',
-                'json_pointer': 'item',
-                'core_table': 'partecipanti',
-                'stg_json_table': 'stg_partecipanti_json',
-                'stg_table': 'stg_partecipanti',
-                'key': 'codice_fiscale',
-                'depends_on': ['cig'],
-                'select_map': {
-                    'codice_fiscale': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.codice_fiscale"))',
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'ruolo': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.ruolo"))',
-                    'denominazione': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.denominazione"))',
-                    'tipo_soggetto': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.tipo_soggetto"))'
-                },
-                'upsert_update_fields': ['ruolo', 'denominazione', 'tipo_soggetto']
-            },
-            'cup': {
-                'name': 'cup',
-                'folder_glob': '*-cup_json',
-                'json_pointer': 'item',
-                'core_table': 'cup',
-                'stg_json_table': 'stg_cup_json',
-                'stg_table': 'stg_cup',
-                'key': 'cup',
-                'depends_on': ['cig'],
-                'select_map': {
-                    'cup': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cup"))',
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))'
-                },
-                'upsert_update_fields': ['cig']
-            },
-            'stazioni_appaltanti': {
-                'name': 'stazioni_appaltanti',
-                'folder_glob': '*-stazioni-appaltanti_json',
-                'json_pointer': 'item',
-                'core_table': 'stazioni_appaltanti',
-                'stg_json_table': 'stg_stazioni_appaltanti_json',
-                'stg_table': 'stg_stazioni_appaltanti',
-                'key': 'codice_fiscale',
-                'depends_on': ['cig'],
-                'select_map': {
-                    'codice_fiscale': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.codice_fiscale"))',
-                    'denominazione': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.denominazione"))',
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))'
-                },
-                'upsert_update_fields': ['denominazione', 'cig']
-            },
-            'categorie_opera': {
-                'name': 'categorie_opera',
-                'folder_glob': '*-categorie-opera_json',
-                'json_pointer': 'item',
-                'core_table': 'categorie_opera',
-                'stg_json_table': 'stg_categorie_opera_json',
-                'stg_table': 'stg_categorie_opera',
-                'key': 'id',
-                'depends_on': ['cig'],
-                'select_map': {
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'id_categoria': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_categoria"))',
-                    'descrizione': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.descrizione"))',
-                    'cod_tipo_categoria': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cod_tipo_categoria"))'
-                },
-                'upsert_update_fields': ['id_categoria', 'descrizione', 'cod_tipo_categoria']
-            },
-            'categorie_dpcm_aggregazione': {
-                'name': 'categorie_dpcm_aggregazione',
-                'folder_glob': '*-categorie-dpcm-aggregazione_json',
-                'json_pointer': 'item',
-                'core_table': 'categorie_dpcm_aggregazione',
-                'stg_json_table': 'stg_categorie_dpcm_aggregazione_json',
-                'stg_table': 'stg_categorie_dpcm_aggregazione',
-                'key': 'id',
-                'depends_on': ['cig'],
-                'select_map': {
-                    'id_categoria': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_categoria"))',
-                    'descrizione': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.descrizione"))',
-                    'cod_tipo_categoria': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cod_tipo_categoria"))',
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))'
-                },
-                'upsert_update_fields': ['id_categoria', 'descrizione', 'cod_tipo_categoria', 'cig']
-            },
-            'lavorazioni': {
-                'name': 'lavorazioni',
-                'folder_glob': '*-lavorazioni_json',
-                'json_pointer': 'item',
-                'core_table': 'lavorazioni',
-                'stg_json_table': 'stg_lavorazioni_json',
-                'stg_table': 'stg_lavorazioni',
-                'key': 'cod_tipo_lavorazione',
-                'depends_on': ['cig'],
-                'select_map': {
-                    'cod_tipo_lavorazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cod_tipo_lavorazione")) AS INT)',
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'tipo_lavorazione': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.tipo_lavorazione"))'
-                },
-                'upsert_update_fields': ['cig', 'tipo_lavorazione']
-            },
-            'subappalti': {
-                'name': 'subappalti',
-                'folder_glob': '*-subappalti_json',
-                'json_pointer': 'item',
-                'core_table': 'subappalti',
-                'stg_json_table': 'stg_subappalti_json',
-                'stg_table': 'stg_subappalti',
-                'key': 'id_subappalto',
-                'depends_on': ['aggiudicazioni'],
-                'select_map': {
-                    'id_subappalto': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_subappalto"))',
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'id_aggiudicazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_aggiudicazione")) AS INT)'
-                },
-                'upsert_update_fields': ['cig', 'id_aggiudicazione']
-            },
-            'stati_avanzamento': {
-                'name': 'stati_avanzamento',
-                'folder_glob': '*-stati-avanzamento_json',
-                'json_pointer': 'item',
-                'core_table': 'stati_avanzamento',
-                'stg_json_table': 'stg_stati_avanzamento_json',
-                'stg_table': 'stg_stati_avanzamento',
-                'key': 'cig',
-                'depends_on': ['aggiudicazioni'],
-                'select_map': {
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'id_aggiudicazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_aggiudicazione")) AS INT)'
-                },
-                'upsert_update_fields': ['id_aggiudicazione']
-            },
-            'varianti': {
-                'name': 'varianti',
-                'folder_glob': '*-varianti_json',
-                'json_pointer': 'item',
-                'core_table': 'varianti',
-                'stg_json_table': 'stg_varianti_json',
-                'stg_table': 'stg_varianti',
-                'key': 'id_variante',
-                'depends_on': ['aggiudicazioni'],
-                'select_map': {
-                    'id_variante': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_variante"))',
-                    'id_aggiudicazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_aggiudicazione")) AS INT)'
-                },
-                'upsert_update_fields': ['id_aggiudicazione']
-            },
-            'fine_contratto': {
-                'name': 'fine_contratto',
-                'folder_glob': '*-fine-contratto_json',
-                'json_pointer': 'item',
-                'core_table': 'fine_contratto',
-                'stg_json_table': 'stg_fine_contratto_json',
-                'stg_table': 'stg_fine_contratto',
-                'key': 'cig',
-                'depends_on': ['aggiudicazioni'],
-                'select_map': {
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'id_aggiudicazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_aggiudicazione")) AS INT)'
-                },
-                'upsert_update_fields': ['id_aggiudicazione']
-            },
-            'collaudo': {
-                'name': 'collaudo',
-                'folder_glob': '*-collaudo_json',
-                'json_pointer': 'item',
-                'core_table': 'collaudo',
-                'stg_json_table': 'stg_collaudo_json',
-                'stg_table': 'stg_collaudo',
-                'key': 'cig',
-                'depends_on': ['aggiudicazioni'],
-                'select_map': {
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'id_aggiudicazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_aggiudicazione")) AS INT)'
-                },
-                'upsert_update_fields': ['id_aggiudicazione']
-            },
-            'quadro_economico': {
-                'name': 'quadro_economico',
-                'folder_glob': '*-quadro-economico_json',
-                'json_pointer': 'item',
-                'core_table': 'quadro_economico',
-                'stg_json_table': 'stg_quadro_economico_json',
-                'stg_table': 'stg_quadro_economico',
-                'key': 'cig',
-                'depends_on': ['aggiudicazioni'],
-                'select_map': {
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'id_aggiudicazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_aggiudicazione")) AS INT)'
-                },
-                'upsert_update_fields': ['id_aggiudicazione']
-            },
-            'fonti_finanziamento': {
-                'name': 'fonti_finanziamento',
-                'folder_glob': '*-fonti-finanziamento_json',
-                'json_pointer': 'item',
-                'core_table': 'fonti_finanziamento',
-                'stg_json_table': 'stg_fonti_finanziamento_json',
-                'stg_table': 'stg_fonti_finanziamento',
-                'key': 'cig',
-                'depends_on': ['aggiudicazioni'],
-                'select_map': {
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'id_aggiudicazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_aggiudicazione")) AS INT)'
-                },
-                'upsert_update_fields': ['id_aggiudicazione']
-            },
-            'avvio_contratto': {
-                'name': 'avvio_contratto',
-                'folder_glob': '*-avvio-contratto_json',
-                'json_pointer': 'item',
-                'core_table': 'avvio_contratto',
-                'stg_json_table': 'stg_avvio_contratto_json',
-                'stg_table': 'stg_avvio_contratto',
-                'key': 'cig',
-                'depends_on': ['aggiudicazioni'],
-                'select_map': {
-                    'cig': 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.cig"))',
-                    'id_aggiudicazione': 'CAST(JSON_UNQUOTE(JSON_EXTRACT(payload, "$.id_aggiudicazione")) AS INT)'
-                },
-                'upsert_update_fields': ['id_aggiudicazione']
-            }
-        }
+        self.predefined_datasets = _PREDEFINED_DATASETS
+        self._datasets: Dict[str, Any] = {}
+        self._datasets_version: Optional[int] = None
     
     def discover_datasets(self) -> Dict[str, Any]:
         """Discover datasets in JSON folders and update registry"""
@@ -305,53 +459,63 @@ class DatasetDiscovery:
         
         discovered_datasets = {}
         unknown_datasets = []
+        seen = {}
         
         if not self.config.json_root.exists():
             logger.warning(f"JSON root directory does not exist: {self.config.json_root}")
             return discovered_datasets
         
-        # Scan for folders matching pattern YYYYMMDD-<dataset>_json
-        pattern = re.compile(r'^\d{8}-(.+)_json$')
-        
-        for folder in self.config.json_root.iterdir():
-            if folder.is_dir():
-                match = pattern.match(folder.name)
+        # Scan for folders matching pattern YYYYMMDD-<dataset>_json.
+        # Names are filtered first so only candidates pay for is_dir().
+        candidates = []
+        with os.scandir(self.config.json_root) as entries:
+            for entry in entries:
+                match = _classify_dataset_folder(entry.name)
                 if match:
-                    dataset_name = match.group(1)
-                    
-                    if dataset_name in self.predefined_datasets:
-                        discovered_datasets[dataset_name] = self.predefined_datasets[dataset_name].copy()
-                        discovered_datasets[dataset_name]['last_seen'] = folder.name
-                        logger.info(f"Discovered known dataset: {dataset_name}")
-                    else:
-                        unknown_datasets.append({
-                            'name': dataset_name,
-                            'folder': folder.name,
-                            'path': str(folder)
-                        })
-                        logger.warning(f"Discovered unknown dataset: {dataset_name}")
+                    candidates.append((entry, *match))
+        
+        for (entry, dataset_name, is_predefined), is_dir in zip(candidates, _check_dirs(candidates)):
+            if not is_dir:
+                continue
+            
+            if is_predefined:
+                seen[dataset_name] = entry.name
+                logger.info("Discovered known dataset: %s", dataset_name)
+            else:
+                unknown_datasets.append(UnknownDataset(sys.intern(dataset_name), entry.name, entry.path))
+                logger.warning("Discovered unknown dataset: %s", dataset_name)
+        
+        discovered_datasets = {
+            name: {**self.predefined_datasets[name], 'last_seen': last_seen}
+            for name, last_seen in seen.items()
+        }
         
         # Update registry
         registry = {
             'datasets': discovered_datasets,
-            'unknown_datasets': unknown_datasets,
-            'discovery_timestamp': str(Path().cwd()),
+            'unknown_datasets': [dataset._asdict() for dataset in unknown_datasets],
+            'discovery_timestamp': time.time_ns(),
             'json_root': str(self.config.json_root),
             'ndjson_root': str(self.config.ndjson_root)
         }
         
         self.config.update_registry(registry)
         
-        # Print results
-        print(f"Dataset Discovery Results:")
-        print(f"Known datasets found: {len(discovered_datasets)}")
-        for name, config in discovered_datasets.items():
-            print(f"  - {name} (last seen: {config.get('last_seen', 'unknown')})")
+        # Print results in a single write
+        lines = [
+            "Dataset Discovery Results:",
+            f"Known datasets found: {len(discovered_datasets)}"
+        ]
+        lines.extend(
+            f"  - {name} (last seen: {config.get('last_seen', 'unknown')})"
+            for name, config in discovered_datasets.items()
+        )
         
         if unknown_datasets:
-            print(f"\nUnknown datasets found: {len(unknown_datasets)}")
-            for dataset in unknown_datasets:
-                print(f"  - {dataset['name']} (folder: {dataset['folder']})")
+            lines.append(f"\nUnknown datasets found: {len(unknown_datasets)}")
+            lines.extend(f"  - {dataset.name} (folder: {dataset.folder})" for dataset in unknown_datasets)
+        
+        sys.stdout.write('\n'.join(lines) + '\n')
         
         logger.info(f"Discovery completed. Found {len(discovered_datasets)} known and {len(unknown_datasets)} unknown datasets")
         
@@ -389,24 +553,70 @@ class DatasetDiscovery:
         }
         
         # Save to config file
-        self.config.save_config()
+        self.config.save_yaml()
         
         print(f"Registry exported to: {self.config.config_path}")
         print(f"Configured datasets: {len(registry.get('datasets', {}))}")
         
         logger.info("Registry export completed")
     
+    def _registry_datasets(self) -> Dict[str, Any]:
+        """Get the registry's datasets mapping, cached until the config changes"""
+        if self._datasets_version != self.config._version:
+            self._datasets = self.config.get_registry().get('datasets', {})
+            self._datasets_version = self.config._version
+        return self._datasets
+    
     def get_dataset_config(self, dataset_name: str) -> Optional[Dict[str, Any]]:
         """Get configuration for a specific dataset"""
-        registry = self.config.get_registry()
-        datasets = registry.get('datasets', {})
-        return datasets.get(dataset_name)
+        return self._registry_datasets().get(dataset_name)
     
     def list_datasets(self) -> List[str]:
         """List all configured datasets"""
-        registry = self.config.get_registry()
-        datasets = registry.get('datasets', {})
-        return list(datasets.keys())
+        return list(self._registry_datasets().keys())
+    
+    def iter_parallel_batches(self, datasets: Optional[List[str]] = None) -> Tuple[Tuple[str, ...], ...]:
+        """Return predefined datasets grouped by dependency level
+
+        Datasets within a level do not depend on each other. When
+        ``datasets`` is given, levels are restricted to those names.
+        """
+        if datasets is None:
+            return _LEVELS
+        
+        wanted = set(datasets)
+        batches = (tuple(name for name in level if name in wanted) for level in _LEVELS)
+        return tuple(batch for batch in batches if batch)
+    
+    def render_generated_ddl(self, dataset_name: str, columns: Optional[List[str]] = None) -> Optional[str]:
+        """Render the ALTER TABLE adding generated columns to stg_<dataset>_json
+
+        Returns None if the dataset has no generated_columns spec (or none
+        of the requested ``columns``). Key and cig columns are also indexed.
+        """
+        config = self.get_dataset_config(dataset_name) or self.predefined_datasets.get(dataset_name)
+        generated = (config or {}).get('generated_columns')
+        if not generated:
+            return None
+        
+        if columns is not None:
+            generated = {column: spec for column, spec in generated.items() if column in columns}
+            if not generated:
+                return None
+        
+        indexed = {config['key'], *_INDEXED_GENERATED_COLUMNS}
+        clauses = [
+            f"ADD COLUMN {column} {sql_type} GENERATED ALWAYS AS ({expression}) STORED "
+            f"COMMENT '{_generated_column_comment(expression, sql_type)}'"
+            for column, (expression, sql_type) in generated.items()
+        ]
+        clauses.extend(
+            f"ADD INDEX idx_{column} ({column}({_GENERATED_INDEX_PREFIX}))" if sql_type == 'TEXT'
+            else f"ADD INDEX idx_{column} ({column})"
+            for column, (_, sql_type) in generated.items() if column in indexed
+        )
+        table_name = config.get('stg_json_table', f"stg_{dataset_name}_json")
+        return f"ALTER TABLE {table_name} " + ", ".join(clauses)
     
     def validate_dataset_config(self, dataset_name: str) -> List[str]:
         """Validate dataset configuration and return any issues"""
@@ -417,14 +627,13 @@ class DatasetDiscovery:
             issues.append(f"Dataset '{dataset_name}' not found in registry")
             return issues
         
-        required_fields = ['name', 'core_table', 'stg_table', 'key', 'select_map']
-        for field in required_fields:
-            if field not in config:
-                issues.append(f"Missing required field: {field}")
+        issues.extend(f"Missing required field: {field}" for field in _REQUIRED_FIELDS if field not in config)
         
         if 'depends_on' in config:
-            for dep in config['depends_on']:
-                if dep not in self.list_datasets():
-                    issues.append(f"Dependency '{dep}' not found in registry")
+            known = self._registry_datasets().keys()
+            issues.extend(
+                f"Dependency '{dep}' not found in registry"
+                for dep in config['depends_on'] if dep not in known
+            )
         
         return issues
@@ -5,18 +5,295 @@ ETL pipeline for ANAC data ingestion
 import logging
 import json
 import hashlib
+import math
+import mmap
+import os
+import re
 import subprocess
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Any, NamedTuple, Optional, Tuple
 from datetime import datetime
-import pymysql
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-from .config import Config
-from .discovery import DatasetDiscovery
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from .config import Config, _atomic_write
+from .db_pool import connect
+from .discovery import DatasetDiscovery, _generated_column_comment
 
 logger = logging.getLogger(__name__)
 
+# etl_files rows are buffered and inserted in batches of this size
+ETL_FILES_BATCH_SIZE = 500
+
+# Secondary indexes of stg_<dataset>_json: index name -> column
+_STAGING_JSON_INDEXES = {'idx_file_name': '_file_name', 'idx_ingested_at': '_ingested_at'}
+
+# Loads of at least this many bytes into an empty stg_<dataset>_json build its indexes afterwards
+DEFER_INDEXES_MIN_BYTES = 64 << 20
+
+# File fingerprints keyed by path: (size, mtime_ns, hash)
+_FILE_HASH_CACHE: Dict[str, tuple] = {}
+
+# Sidecar under cache_root persisting _FILE_HASH_CACHE across runs
+HASH_CACHE_FILE = 'file_hashes.json'
+
+def _json_loads(raw: bytes) -> Any:
+    """Parse JSON bytes, using orjson when available"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def _ndjson_line(item: Any) -> bytes:
+    """Serialize one record as a UTF-8 NDJSON line, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(item) + b'\n'
+    return (json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8')
+
+class JsonPointer(NamedTuple):
+    """A dataset's json_pointer, split once (picklable for worker processes)
+
+    A trailing 'item' selects the elements of the array at that path,
+    as in ijson prefixes: 'item' is a top-level array and 'records.item'
+    the array under the 'records' key.
+    """
+    keys: Tuple[str, ...]
+    array: bool
+    
+    @property
+    def is_top_level_array(self) -> bool:
+        return self.array and not self.keys
+    
+    def __call__(self, data: Any) -> List[Any]:
+        """Select the records of a parsed document"""
+        items = data
+        for key in self.keys:
+            items = items.get(key, []) if isinstance(items, dict) else []
+        if self.array and isinstance(items, dict):
+            items = items.get('item', [])
+        
+        return items if isinstance(items, list) else [items]
+
+def _compile_pointer(json_pointer: str) -> JsonPointer:
+    """Split a json_pointer such as 'item' or 'records.item' into a JsonPointer"""
+    parts = tuple(json_pointer.split('.'))
+    if parts[-1] == 'item':
+        return JsonPointer(parts[:-1], True)
+    return JsonPointer(parts, False)
+
+def _iter_json_items(json_file: Path, pointer: JsonPointer) -> Iterator[Any]:
+    """Yield the records of a JSON file selected by pointer
+
+    A top-level array is streamed with ijson (when installed), keeping
+    one record in memory at a time. Other layouts are loaded whole.
+    """
+    with open(json_file, 'rb') as f:
+        if ijson is not None and pointer.is_top_level_array:
+            head = f.read(1024).lstrip()
+            f.seek(0)
+            if head.startswith(b'['):
+                yield from ijson.items(f, 'item', use_float=True)
+                return
+        
+        data = _json_loads(f.read())
+    
+    yield from pointer(data)
+
+# select_map expressions that convert_and_stage can evaluate in Python
+_JSON_FIELD_RE = r'JSON_UNQUOTE\(JSON_EXTRACT\(payload, "\$\.(\w+)"\)\)'
+_SELECT_EXPRESSIONS = [
+    (re.compile(rf'^{_JSON_FIELD_RE}$'), None),
+    (re.compile(rf'^CAST\({_JSON_FIELD_RE} AS (DOUBLE|SIGNED|INT)\)$'), 'cast'),
+    (re.compile(rf'^STR_TO_DATE\({_JSON_FIELD_RE}, "%Y-%m-%d"\)$'), 'date'),
+]
+
+def _json_text(value: Any) -> str:
+    """Render a JSON value the way JSON_UNQUOTE(JSON_EXTRACT(...)) returns it"""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+def _to_double(text: str) -> Optional[str]:
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return repr(value) if math.isfinite(value) else None
+
+def _to_int(text: str) -> Optional[str]:
+    try:
+        return str(int(text))
+    except ValueError:
+        try:
+            return str(int(float(text)))
+        except (ValueError, OverflowError):
+            return None
+
+def _to_date(text: str) -> Optional[str]:
+    try:
+        return datetime.strptime(text[:10], '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        return None
+
+# INT casts come from registries written before discovery spelled them AS SIGNED
+_CONVERTERS = {'DOUBLE': _to_double, 'SIGNED': _to_int, 'INT': _to_int, 'date': _to_date}
+
+def _compile_select_map(select_map: Dict[str, str]) -> Optional[Callable[[Any], list]]:
+    """Compile select_map into a function projecting one record to column values
+
+    Only the expression shapes built by discovery (plain field, CAST to
+    DOUBLE/SIGNED, STR_TO_DATE) are supported; returns None if any column
+    uses something else. Values MySQL would coerce with a warning become
+    None (NULL).
+    """
+    columns = []
+    for expression in select_map.values():
+        for pattern, kind in _SELECT_EXPRESSIONS:
+            match = pattern.match(expression)
+            if match:
+                break
+        else:
+            return None
+        
+        field = match.group(1)
+        if kind == 'cast':
+            convert = _CONVERTERS[match.group(2)]
+        else:
+            convert = _CONVERTERS.get(kind)
+        columns.append((field, convert))
+    
+    def project(item: Any) -> list:
+        values = []
+        for field, convert in columns:
+            if not isinstance(item, dict) or field not in item:
+                values.append(None)
+                continue
+            
+            # JSON null unquotes to the string 'null', which no converter accepts
+            value = _json_text(item[field])
+            values.append(convert(value) if convert is not None else value)
+        return values
+    
+    return project
+
+_TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+def _tsv_line(values: list) -> str:
+    """Format column values as a LOAD DATA line (tab separated, \\N for NULL)"""
+    return '\t'.join('\\N' if value is None else value.translate(_TSV_ESCAPES) for value in values) + '\n'
+
+def _drain_fifo(path: str, writer: threading.Thread):
+    """Read and discard a FIFO until its writer thread exits
+    
+    Used when the reader gave up partway (or never opened the pipe): the
+    read end lets a writer blocked in open() proceed, and draining frees
+    one blocked in write() on a full pipe, so it can see the stop flag.
+    """
+    read_fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        while writer.is_alive():
+            try:
+                if os.read(read_fd, 1 << 16):
+                    continue
+            except BlockingIOError:
+                pass
+            # Empty pipe or no writer yet: wait instead of spinning
+            writer.join(0.05)
+    finally:
+        os.close(read_fd)
+
+@contextmanager
+def _streamed_infile(chunks: Iterator[bytes]) -> Iterator[str]:
+    """Expose generated bytes as a path for LOAD DATA LOCAL INFILE
+    
+    Where named pipes exist the bytes are fed through a FIFO by a writer
+    thread, so they never touch the disk; elsewhere they are spooled to
+    a temporary file first. Errors raised while producing the bytes are
+    re-raised on exit, so a truncated stream is never committed.
+    """
+    with tempfile.TemporaryDirectory(prefix='anac_infile_') as tmp_dir:
+        path = os.path.join(tmp_dir, 'data')
+        if not hasattr(os, 'mkfifo'):
+            with open(path, 'wb') as f:
+                f.writelines(chunks)
+            yield path
+            return
+        
+        os.mkfifo(path)
+        errors = []
+        stop = threading.Event()
+        
+        def feed():
+            try:
+                with open(path, 'wb') as f:
+                    for chunk in chunks:
+                        if stop.is_set():
+                            break
+                        f.write(chunk)
+            except Exception as e:
+                errors.append(e)
+        
+        writer = threading.Thread(target=feed, name='anac-infile-writer', daemon=True)
+        writer.start()
+        try:
+            yield path
+        finally:
+            stop.set()
+            if writer.is_alive():
+                _drain_fifo(path, writer)
+            writer.join()
+        
+        if errors and not isinstance(errors[0], BrokenPipeError):
+            raise errors[0]
+
+def _hash_algorithm() -> str:
+    """Name of the hash function returned by _hash_factory"""
+    return 'xxh3_128' if xxhash is not None else 'md5'
+
+def _hash_factory():
+    """Constructor of the hash function used for file fingerprints"""
+    return xxhash.xxh3_128 if xxhash is not None else hashlib.md5
+
+def _hash_file(file_path: Path) -> str:
+    """Hash a file with xxh3_128 (if xxhash is installed) or MD5"""
+    digest = _hash_factory()
+    with open(file_path, "rb") as f:
+        if hasattr(hashlib, 'file_digest'):
+            # Python 3.11+: C-level read loop into a reused buffer
+            return hashlib.file_digest(f, digest).hexdigest()
+        
+        file_hash = digest()
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                file_hash.update(mapped)
+        return file_hash.hexdigest()
+
+def _cpu_workers(config: Config) -> int:
+    """Processes for CPU-bound JSON conversion (etl.cpu_workers, etl.parallel_workers, or the core count)"""
+    etl = config.config.get('etl', {})
+    return etl.get('cpu_workers') or etl.get('parallel_workers') or os.cpu_count() or 1
+
+def _io_workers(config: Config) -> int:
+    """Threads for I/O-bound file hashing (etl.io_workers, default 4 per core up to 32)"""
+    return config.config.get('etl', {}).get('io_workers') or min(32, (os.cpu_count() or 1) * 4)
+
 class IngestPipeline:
     """Manages ETL pipeline for ANAC data ingestion"""
     
@@ -25,42 +302,82 @@ class IngestPipeline:
         self.discovery = DatasetDiscovery(config)
         self.connection = None
         self.current_run_id = None
+        # Pending etl_files rows, flushed by _flush_etl_files
+        self._etl_file_rows = []
+        # Datasets whose JSON staging table is known to carry its generated columns,
+        # and those that fell back to the expression projection
+        self._generated_ready = set()
+        self._generated_unavailable = set()
+        # Set when a file is hashed, so the hash sidecar is rewritten
+        self._hash_cache_dirty = False
+        # Registry entries looked up so far, valid for config version _dataset_configs_version
+        self._dataset_configs = {}
+        self._dataset_configs_version = None
+        
+    def _dataset_config(self, dataset: str) -> Optional[Dict[str, Any]]:
+        """Get a dataset's registry entry, memoized until the config changes"""
+        if self._dataset_configs_version != self.config._version:
+            self._dataset_configs = {}
+            self._dataset_configs_version = self.config._version
         
+        try:
+            return self._dataset_configs[dataset]
+        except KeyError:
+            dataset_config = self._dataset_configs[dataset] = self.discovery.get_dataset_config(dataset)
+            return dataset_config
+    
     def _get_connection(self):
-        """Get database connection"""
+        """Get database connection (from the shared pool when DBUtils is installed)"""
         if not self.connection:
-            self.connection = pymysql.connect(
-                host=self.config.db_host,
-                port=self.config.db_port,
-                user=self.config.db_user,
-                password=self.config.db_password,
-                database=self.config.db_name,
-                charset='utf8mb4',
-                autocommit=False
-            )
+            self.connection = connect(self.config, local_infile=True)
         return self.connection
     
     def _close_connection(self):
-        """Close database connection"""
+        """Close database connection (pooled connections go back to the pool)"""
         if self.connection:
             self.connection.close()
             self.connection = None
     
-    def _execute_sql(self, sql: str, params: tuple = None) -> Any:
-        """Execute SQL statement"""
+    def _run_sql(self, sql: str, params: tuple = None, commit: bool = True) -> Tuple[Any, int, int]:
+        """Execute SQL statement, returning (rows, lastrowid, rowcount)"""
         conn = self._get_connection()
-        cursor = conn.cursor()
         try:
-            cursor.execute(sql, params)
-            result = cursor.fetchall()
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                result = cursor.fetchall()
+                lastrowid = cursor.lastrowid
+                rowcount = cursor.rowcount
+            if commit:
+                conn.commit()
+            return result, lastrowid, rowcount
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"SQL execution failed: {e}")
+            raise
+    
+    def _execute_read(self, sql: str, params: tuple = None) -> Any:
+        """Execute a read-only statement and return its rows (no commit)"""
+        return self._run_sql(sql, params, commit=False)[0]
+    
+    def _execute_write(self, sql: str, params: tuple = None) -> int:
+        """Execute a write statement, commit, and return the affected row count"""
+        return self._run_sql(sql, params)[2]
+    
+    def _execute_insert(self, sql: str, params: tuple = None) -> int:
+        """Execute an INSERT and return the generated AUTO_INCREMENT id"""
+        return self._run_sql(sql, params)[1]
+    
+    def _execute_many(self, sql: str, rows: List[tuple]):
+        """Execute a statement for many parameter rows in one transaction"""
+        conn = self._get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.executemany(sql, rows)
             conn.commit()
-            return result
         except Exception as e:
             conn.rollback()
             logger.error(f"SQL execution failed: {e}")
             raise
-        finally:
-            cursor.close()
     
     def _start_etl_run(self, notes: str = "") -> int:
         """Start a new ETL run and return run_id"""
@@ -68,11 +385,7 @@ class IngestPipeline:
         INSERT INTO etl_runs (started_at, status, notes)
         VALUES (NOW(), 'RUNNING', %s)
         """
-        self._execute_sql(sql, (notes,))
-        
-        # Get the run_id
-        result = self._execute_sql("SELECT LAST_INSERT_ID()")
-        run_id = result[0][0]
+        run_id = self._execute_insert(sql, (notes,))
         self.current_run_id = run_id
         
         logger.info(f"Started ETL run {run_id}")
@@ -83,38 +396,117 @@ class IngestPipeline:
         if not self.current_run_id:
             return
         
+        self._flush_etl_files()
+        
         sql = """
         UPDATE etl_runs 
         SET ended_at = NOW(), status = %s, total_files = %s, total_rows = %s, total_errors = %s
         WHERE run_id = %s
         """
-        self._execute_sql(sql, (status, total_files, total_rows, total_errors, self.current_run_id))
+        self._execute_write(sql, (status, total_files, total_rows, total_errors, self.current_run_id))
         
         logger.info(f"Ended ETL run {self.current_run_id} with status {status}")
         self.current_run_id = None
     
-    def _record_etl_file(self, dataset: str, file_path: str, md5: str, rows_loaded: int, status: str, error_msg: str = None) -> int:
-        """Record ETL file processing"""
+    def _record_etl_file(self, dataset: str, file_path: str, md5: str, rows_loaded: int, status: str,
+                         error_msg: str = None, started_at: datetime = None):
+        """Record ETL file processing (buffered, see _flush_full_etl_files)"""
+        ended_at = datetime.now()
+        self._etl_file_rows.append((
+            self.current_run_id, dataset, file_path, md5, rows_loaded, status, error_msg,
+            started_at or ended_at, ended_at
+        ))
+    
+    def _flush_full_etl_files(self):
+        """Flush buffered etl_files rows once a batch is full
+        
+        Called between files, outside their error handling, so a failed
+        flush is never counted against a file; its rows stay buffered and
+        are retried by the next flush (at the latest by _end_etl_run).
+        """
+        if len(self._etl_file_rows) < ETL_FILES_BATCH_SIZE:
+            return
+        
+        try:
+            self._flush_etl_files()
+        except Exception as e:
+            logger.warning(f"Could not record {len(self._etl_file_rows)} etl_files rows, retrying later: {e}")
+    
+    def _flush_etl_files(self):
+        """Insert buffered etl_files rows with a single executemany
+        
+        The buffer is only cleared once the rows are committed.
+        """
+        if not self._etl_file_rows:
+            return
+        
         sql = """
         INSERT INTO etl_files (run_id, dataset, path, md5, rows_loaded, status, error_msg, started_at, ended_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
-        self._execute_sql(sql, (self.current_run_id, dataset, file_path, md5, rows_loaded, status, error_msg))
-        
-        result = self._execute_sql("SELECT LAST_INSERT_ID()")
-        return result[0][0]
+        self._execute_many(sql, self._etl_file_rows)
+        self._etl_file_rows = []
     
     def _calculate_file_md5(self, file_path: Path) -> str:
-        """Calculate MD5 hash of file"""
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+        """Calculate the file fingerprint stored in etl_files.md5
+        
+        Uses xxh3_128 when xxhash is installed (same 32-hex-char width as
+        MD5, several times faster), MD5 otherwise. The value is only used
+        for provenance, not for security. Results are cached per process
+        by (path, size, mtime_ns), so unchanged files are hashed once, and
+        persisted across runs by _load_hash_cache/_save_hash_cache.
+        """
+        st = os.stat(file_path)
+        key = str(file_path)
+        cached = _FILE_HASH_CACHE.get(key)
+        if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+            return cached[2]
+        
+        file_hash = _hash_file(file_path)
+        _FILE_HASH_CACHE[key] = (st.st_size, st.st_mtime_ns, file_hash)
+        self._hash_cache_dirty = True
+        return file_hash
+    
+    def _hash_cache_path(self) -> Path:
+        return self.config.cache_root / HASH_CACHE_FILE
+    
+    def _load_hash_cache(self):
+        """Merge the persisted file hashes into the in-process cache"""
+        try:
+            with open(self._hash_cache_path(), 'rb') as f:
+                data = _json_loads(f.read())
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable hash cache: {e}")
+            return
+        
+        # Fingerprints from the other hash function would never match
+        if data.get('algorithm') != _hash_algorithm():
+            return
+        for path, (size, mtime_ns, file_hash) in data.get('files', {}).items():
+            _FILE_HASH_CACHE.setdefault(path, (size, mtime_ns, file_hash))
+    
+    def _save_hash_cache(self):
+        """Atomically rewrite the hash sidecar if new hashes were computed
+        
+        Entries for files that no longer exist are dropped.
+        """
+        if not self._hash_cache_dirty:
+            return
+        
+        for path in [path for path in _FILE_HASH_CACHE if not os.path.exists(path)]:
+            del _FILE_HASH_CACHE[path]
+        data = {
+            'algorithm': _hash_algorithm(),
+            'files': {path: list(entry) for path, entry in _FILE_HASH_CACHE.items()}
+        }
+        _atomic_write(str(self._hash_cache_path()), json.dumps(data).encode('utf-8'))
+        self._hash_cache_dirty = False
     
     def _find_json_files(self, dataset: str, since: str = None) -> List[Path]:
         """Find JSON files for a dataset"""
-        dataset_config = self.discovery.get_dataset_config(dataset)
+        dataset_config = self._dataset_config(dataset)
         if not dataset_config:
             logger.warning(f"Dataset {dataset} not found in registry")
             return []
@@ -123,7 +515,7 @@ class IngestPipeline:
         pattern = dataset_config['folder_glob']
         
         # Find matching folders
-        for folder in self.config.json_root.glob(f"*-{dataset}_json"):
+        for folder in self.config.json_root.glob(pattern):
             if since and folder.name < since:
                 continue
             
@@ -137,16 +529,21 @@ class IngestPipeline:
         """Convert JSON files to NDJSON format"""
         logger.info("Starting JSON to NDJSON conversion")
         
-        if all_datasets:
-            datasets = self.discovery.list_datasets()
-        elif dataset:
+        if dataset and not all_datasets:
             datasets = [dataset]
         else:
-            datasets = self.discovery.list_datasets()
+            # Datasets staged by convert_and_stage or streamed by the load have no NDJSON stage
+            datasets = [name for name in self.discovery.list_datasets()
+                        if self._stages_raw_json(name) and self._writes_ndjson(name)]
         
         total_files = 0
         total_errors = 0
         
+        # Output hashes computed while writing are added to the hash cache
+        self._load_hash_cache()
+        
+        # Prepare output paths on the main process, then convert in parallel
+        tasks = []
         for dataset_name in datasets:
             logger.info(f"Converting dataset: {dataset_name}")
             
@@ -155,8 +552,9 @@ class IngestPipeline:
                 logger.warning(f"No JSON files found for dataset {dataset_name}")
                 continue
             
-            dataset_config = self.discovery.get_dataset_config(dataset_name)
-            json_pointer = dataset_config.get('json_pointer', 'item')
+            dataset_config = self._dataset_config(dataset_name)
+            # Compiled once per dataset and shipped to the workers with each task
+            pointer = _compile_pointer(dataset_config.get('json_pointer', 'item'))
             
             for json_file in json_files:
                 try:
@@ -167,42 +565,77 @@ class IngestPipeline:
                     # Create output directory
                     ndjson_path.parent.mkdir(parents=True, exist_ok=True)
                     
-                    # Convert JSON to NDJSON
-                    self._convert_single_json_file(json_file, ndjson_path, json_pointer)
-                    
-                    total_files += 1
-                    logger.info(f"Converted: {json_file} -> {ndjson_path}")
+                    tasks.append((json_file, ndjson_path, pointer))
                     
                 except Exception as e:
                     total_errors += 1
                     logger.error(f"Error converting {json_file}: {e}")
         
+        for json_file, ndjson_path, fingerprint, error in self._run_conversions(tasks):
+            if error is None:
+                total_files += 1
+                # The load stage finds this and skips re-reading the file
+                _FILE_HASH_CACHE[str(ndjson_path)] = fingerprint
+                self._hash_cache_dirty = True
+                logger.info(f"Converted: {json_file} -> {ndjson_path}")
+            else:
+                total_errors += 1
+                logger.error(f"Error converting {json_file}: {error}")
+        
+        self._save_hash_cache()
         logger.info(f"Conversion completed. Files: {total_files}, Errors: {total_errors}")
     
-    def _convert_single_json_file(self, json_file: Path, ndjson_path: Path, json_pointer: str):
-        """Convert a single JSON file to NDJSON"""
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        # Extract items using json_pointer
-        if json_pointer == 'item' and isinstance(data, list):
-            items = data
-        elif '.' in json_pointer:
-            # Handle nested pointers like "records.item"
-            parts = json_pointer.split('.')
-            items = data
-            for part in parts:
-                items = items.get(part, [])
-        else:
-            items = data.get(json_pointer, [])
+    def _run_conversions(self, tasks: List[tuple]):
+        """Convert (json_file, ndjson_path, pointer) tasks across processes
+        
+        Yields (json_file, ndjson_path, fingerprint, error) as each
+        conversion finishes; on success error is None and fingerprint is
+        the output's (size, mtime_ns, hash), otherwise fingerprint is None.
+        """
+        if len(tasks) <= 1:
+            for json_file, ndjson_path, pointer in tasks:
+                try:
+                    fingerprint = self._convert_single_json_file(json_file, ndjson_path, pointer)
+                    yield json_file, ndjson_path, fingerprint, None
+                except Exception as e:
+                    yield json_file, ndjson_path, None, e
+            return
+        
+        with ProcessPoolExecutor(max_workers=min(_cpu_workers(self.config), len(tasks))) as executor:
+            futures = {
+                executor.submit(self._convert_single_json_file, json_file, ndjson_path, pointer): (json_file, ndjson_path)
+                for json_file, ndjson_path, pointer in tasks
+            }
+            for future in as_completed(futures):
+                json_file, ndjson_path = futures[future]
+                try:
+                    yield json_file, ndjson_path, future.result(), None
+                except Exception as e:
+                    yield json_file, ndjson_path, None, e
+    
+    @staticmethod
+    def _convert_single_json_file(json_file: Path, ndjson_path: Path, pointer: JsonPointer) -> tuple:
+        """Convert a single JSON file to NDJSON (static so worker processes can run it)
         
-        if not isinstance(items, list):
-            items = [items]
+        The output is hashed as it is written; returns its (size, mtime_ns, hash).
+        """
+        # Write to a temporary file so a streaming parse error never leaves
+        # a truncated .ndjson behind
+        tmp_path = ndjson_path.with_name(ndjson_path.name + '.tmp')
+        file_hash = _hash_factory()()
+        try:
+            with open(tmp_path, 'wb') as f:
+                for item in _iter_json_items(json_file, pointer):
+                    line = _ndjson_line(item)
+                    file_hash.update(line)
+                    f.write(line)
+            os.replace(tmp_path, ndjson_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
         
-        # Write NDJSON
-        with open(ndjson_path, 'w', encoding='utf-8') as f:
-            for item in items:
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        st = os.stat(ndjson_path)
+        return st.st_size, st.st_mtime_ns, file_hash.hexdigest()
     
     def load_ndjson_to_staging(self, dataset: str = None, since: str = None, all_datasets: bool = False):
         """Load NDJSON files to staging tables"""
@@ -211,47 +644,76 @@ class IngestPipeline:
         run_id = self._start_etl_run("NDJSON to staging load")
         
         try:
-            if all_datasets:
-                datasets = self.discovery.list_datasets()
-            elif dataset:
+            if dataset and not all_datasets:
                 datasets = [dataset]
             else:
-                datasets = self.discovery.list_datasets()
+                datasets = [name for name in self.discovery.list_datasets() if self._stages_raw_json(name)]
             
             total_files = 0
             total_rows = 0
             total_errors = 0
             
-            for dataset_name in datasets:
-                logger.info(f"Loading dataset: {dataset_name}")
-                
-                # Create staging JSON table if not exists
-                self._create_staging_json_table(dataset_name)
-                
-                # Find NDJSON files
-                ndjson_files = self._find_ndjson_files(dataset_name, since)
-                if not ndjson_files:
-                    logger.warning(f"No NDJSON files found for dataset {dataset_name}")
-                    continue
-                
-                for ndjson_file in ndjson_files:
-                    try:
-                        rows_loaded = self._load_single_ndjson_file(dataset_name, ndjson_file)
-                        
-                        md5 = self._calculate_file_md5(ndjson_file)
-                        self._record_etl_file(dataset_name, str(ndjson_file), md5, rows_loaded, 'OK')
-                        
-                        total_files += 1
-                        total_rows += rows_loaded
-                        
-                        logger.info(f"Loaded {rows_loaded} rows from {ndjson_file}")
-                        
-                    except Exception as e:
-                        total_errors += 1
-                        md5 = self._calculate_file_md5(ndjson_file)
-                        self._record_etl_file(dataset_name, str(ndjson_file), md5, 0, 'ERROR', str(e))
-                        logger.error(f"Error loading {ndjson_file}: {e}")
+            # Files are hashed in background threads while earlier ones load;
+            # unchanged files reuse the hash recorded by an earlier run
+            self._load_hash_cache()
+            hash_workers = _io_workers(self.config)
+            with ThreadPoolExecutor(max_workers=hash_workers) as hash_executor:
+                for dataset_name in datasets:
+                    logger.info(f"Loading dataset: {dataset_name}")
+                    
+                    # Create staging JSON table if not exists
+                    self._create_staging_json_table(dataset_name)
+                    
+                    # Find NDJSON files, or the JSON files to stream from
+                    if self._writes_ndjson(dataset_name):
+                        ndjson_files = self._find_ndjson_files(dataset_name, since)
+                        pointer = None
+                    else:
+                        ndjson_files = self._find_json_files(dataset_name, since)
+                        pointer = _compile_pointer(self._dataset_config(dataset_name).get('json_pointer', 'item'))
+                    if not ndjson_files:
+                        logger.warning(f"No NDJSON files found for dataset {dataset_name}")
+                        continue
+                    
+                    # Skip loaded files before queueing any hashing, so re-runs read nothing
+                    loaded_keys = self._loaded_file_keys(dataset_name)
+                    file_keys = {}
+                    for ndjson_file in ndjson_files:
+                        file_key = self.config.staging_file_key(ndjson_file)
+                        if file_key in loaded_keys:
+                            logger.info(f"File {ndjson_file} already loaded, skipping")
+                        else:
+                            file_keys[ndjson_file] = file_key
+                    
+                    with self._deferred_staging_indexes(dataset_name, list(file_keys)):
+                        hashed_files = self._prefetch_file_hashes(hash_executor, list(file_keys), 2 * hash_workers)
+                        for ndjson_file, md5_future in hashed_files:
+                            started_at = datetime.now()
+                            md5 = None
+                            try:
+                                file_key = file_keys[ndjson_file]
+                                
+                                # Hashed once up front and shared by both outcomes
+                                md5 = md5_future.result()
+                                rows_loaded = self._load_staging_file(dataset_name, ndjson_file, file_key, md5, pointer)
+                                
+                                self._record_etl_file(dataset_name, str(ndjson_file), md5, rows_loaded, 'OK',
+                                                      started_at=started_at)
+                                
+                                total_files += 1
+                                total_rows += rows_loaded
+                                
+                                logger.info(f"Loaded {rows_loaded} rows from {ndjson_file}")
+                            
+                            except Exception as e:
+                                total_errors += 1
+                                self._record_etl_file(dataset_name, str(ndjson_file), md5, 0, 'ERROR', str(e),
+                                                      started_at=started_at)
+                                logger.error(f"Error loading {ndjson_file}: {e}")
+                            
+                            self._flush_full_etl_files()
             
+            self._save_hash_cache()
             self._end_etl_run('OK' if total_errors == 0 else 'PARTIAL', total_files, total_rows, total_errors)
             
         except Exception as e:
@@ -261,12 +723,24 @@ class IngestPipeline:
         finally:
             self._close_connection()
     
+    def _prefetch_file_hashes(self, executor: ThreadPoolExecutor, files: List[Path], lookahead: int):
+        """Yield (file, hash_future) pairs, keeping up to lookahead hashes in flight"""
+        pending = deque()
+        for file_path in files:
+            pending.append((file_path, executor.submit(self._calculate_file_md5, file_path)))
+            if len(pending) > lookahead:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    
     def _find_ndjson_files(self, dataset: str, since: str = None) -> List[Path]:
         """Find NDJSON files for a dataset"""
         ndjson_files = []
+        dataset_config = self._dataset_config(dataset) or {}
+        pattern = dataset_config.get('folder_glob', f"*-{dataset}_json")
         
-        # Find matching folders
-        for folder in self.config.ndjson_root.glob(f"*-{dataset}_json"):
+        # Find matching folders (NDJSON mirrors the JSON folder layout)
+        for folder in self.config.ndjson_root.glob(pattern):
             if since and folder.name < since:
                 continue
             
@@ -290,37 +764,281 @@ class IngestPipeline:
             INDEX idx_ingested_at (_ingested_at)
         )
         """
-        self._execute_sql(sql)
+        self._execute_write(sql)
+        self._ensure_generated_columns(dataset)
     
-    def _load_single_ndjson_file(self, dataset: str, ndjson_file: Path) -> int:
-        """Load a single NDJSON file to staging"""
+    @contextmanager
+    def _deferred_staging_indexes(self, dataset: str, files: List[Path]):
+        """Build stg_{dataset}_json's secondary indexes after a large load instead of row by row
+
+        The indexes are only dropped when the table is empty and the files
+        add up to DEFER_INDEXES_MIN_BYTES, so re-adding them sorts just the
+        rows loaded here. Indexes left dropped by an interrupted run are
+        re-added on exit as well.
+        """
+        if not files:
+            yield
+            return
+        
         table_name = f"stg_{dataset}_json"
-        file_name = ndjson_file.name
+        result = self._execute_read("""
+            SELECT DISTINCT index_name FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s
+        """, (table_name,))
+        existing = {row[0] for row in result}
+        present = [index for index in _STAGING_JSON_INDEXES if index in existing]
+        missing = [index for index in _STAGING_JSON_INDEXES if index not in existing]
+        
+        if (present and sum(os.path.getsize(file_path) for file_path in files) >= DEFER_INDEXES_MIN_BYTES
+                and not self._execute_read(f"SELECT 1 FROM {table_name} LIMIT 1")):
+            logger.info(f"Deferring {', '.join(present)} on {table_name} until the load completes")
+            self._execute_write(f"ALTER TABLE {table_name} " + ", ".join(f"DROP INDEX {index}" for index in present))
+            missing = list(_STAGING_JSON_INDEXES)
+        
+        try:
+            yield
+        finally:
+            if missing:
+                logger.info(f"Building {', '.join(missing)} on {table_name}")
+                self._execute_write(f"ALTER TABLE {table_name} " + ", ".join(
+                    f"ADD INDEX {index} ({_STAGING_JSON_INDEXES[index]})" for index in missing
+                ))
+    
+    def _ensure_generated_columns(self, dataset: str) -> bool:
+        """Add missing or outdated generated columns to the JSON staging table
+
+        Returns True if the dataset declares generated_columns matching its
+        select_map and the table now has all of them. Columns are tagged
+        with a digest of their definition, so ones built from an older
+        select_map are rebuilt. Columns are only changed on an empty table
+        (adding STORED columns rebuilds it and evaluates the expressions
+        over every existing row); if the table already holds rows or the
+        ALTER fails, the dataset keeps the expression-based projection and
+        False is returned.
+        """
+        if dataset in self._generated_ready:
+            return True
+        if dataset in self._generated_unavailable:
+            return False
         
-        # Count existing rows for this file
-        count_sql = f"SELECT COUNT(*) FROM {table_name} WHERE _file_name = %s"
-        result = self._execute_sql(count_sql, (file_name,))
-        existing_rows = result[0][0]
+        dataset_config = self._dataset_config(dataset) or {}
+        generated = dataset_config.get('generated_columns')
+        if not generated:
+            return False
         
-        if existing_rows > 0:
-            logger.info(f"File {file_name} already loaded ({existing_rows} rows), skipping")
-            return existing_rows
+        table_name = f"stg_{dataset}_json"
+        select_map = dataset_config.get('select_map', {})
+        if any(generated.get(column, [None])[0] != expression for column, expression in select_map.items()):
+            logger.warning(f"generated_columns of {dataset} do not match its select_map; "
+                           f"projecting from the payload instead")
+            self._generated_unavailable.add(dataset)
+            return False
         
-        # Load data using LOAD DATA LOCAL INFILE
-        sql = f"""
+        result = self._execute_read("""
+            SELECT column_name, column_comment FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = %s
+        """, (table_name,))
+        existing = dict(result)
+        stale = [
+            column for column, (expression, sql_type) in generated.items()
+            if column in existing and existing[column] != _generated_column_comment(expression, sql_type)
+        ]
+        missing = [column for column in generated if column not in existing]
+        
+        if stale or missing:
+            if self._execute_read(f"SELECT 1 FROM {table_name} LIMIT 1"):
+                logger.warning(f"{table_name} already holds rows, not changing generated columns "
+                               f"({', '.join(stale + missing)}); projecting from the payload instead")
+                self._generated_unavailable.add(dataset)
+                return False
+            
+            logger.info(f"Adding generated columns to {table_name}: {', '.join(stale + missing)}")
+            try:
+                if stale:
+                    self._execute_write(f"ALTER TABLE {table_name} " +
+                                        ", ".join(f"DROP COLUMN {column}" for column in stale))
+                self._execute_write(self.discovery.render_generated_ddl(dataset, stale + missing))
+            except Exception as e:
+                logger.warning(f"Could not add generated columns to {table_name}, "
+                               f"projecting from the payload instead: {e}")
+                self._generated_unavailable.add(dataset)
+                return False
+        
+        self._generated_ready.add(dataset)
+        return True
+    
+    def _load_staging_file(self, dataset: str, file_path: Path, file_key: str, md5: str,
+                           pointer: Optional[JsonPointer]) -> int:
+        """Load one file into stg_{dataset}_json and mark it loaded in the same transaction
+        
+        A committed load always has its etl_loaded_files row, so a run that
+        is interrupted after some loads never loads those files twice.
+        NDJSON files are read from disk; with a pointer, file_path is a JSON
+        file streamed as NDJSON.
+        """
+        conn = self._get_connection()
+        try:
+            if pointer is None:
+                rows_loaded = self._load_single_ndjson_file(dataset, file_path)
+            else:
+                rows_loaded = self._stream_single_json_file(dataset, file_path, pointer)
+            
+            self._run_sql("""
+                INSERT INTO etl_loaded_files (dataset, file_key, run_id, md5, rows_loaded)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (dataset, file_key, self.current_run_id, md5, rows_loaded), commit=False)
+            conn.commit()
+            return rows_loaded
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def _load_single_ndjson_file(self, dataset: str, ndjson_file: Path) -> int:
+        """Load a single NDJSON file to staging (not committed, see _load_staging_file)"""
+        file_name = ndjson_file.name
+        
+        # Affected rows come back in the OK packet of LOAD DATA
+        return self._run_sql(self._json_load_sql(dataset), (str(ndjson_file), file_name), commit=False)[2]
+    
+    def _stream_single_json_file(self, dataset: str, json_file: Path, pointer: JsonPointer) -> int:
+        """Load a JSON file to staging as NDJSON streamed to the server, without an NDJSON file
+        
+        Not committed, see _load_staging_file.
+        """
+        # Same staging file name as the NDJSON conversion would produce
+        file_name = json_file.with_suffix('.ndjson').name
+        lines = (_ndjson_line(item) for item in _iter_json_items(json_file, pointer))
+        return self._load_local_stream(self._json_load_sql(dataset), lines, (file_name,), commit=False)
+    
+    def _loaded_file_keys(self, dataset: str) -> set:
+        """Staging file keys (Config.staging_file_key) already loaded for a dataset (one query per dataset)"""
+        result = self._execute_read("SELECT file_key FROM etl_loaded_files WHERE dataset = %s", (dataset,))
+        return {row[0] for row in result}
+    
+    def _json_load_sql(self, dataset: str) -> str:
+        """LOAD DATA statement for NDJSON into stg_{dataset}_json (params: infile, file name)"""
+        return f"""
         LOAD DATA LOCAL INFILE %s
-        INTO TABLE {table_name}
+        INTO TABLE stg_{dataset}_json
         FIELDS TERMINATED BY '\n'
         LINES TERMINATED BY '\n'
         (payload)
         SET _file_name = %s
         """
+    
+    def _load_local_stream(self, sql: str, chunks: Iterator[bytes], params: tuple = (), commit: bool = True) -> int:
+        """Run a LOAD DATA LOCAL INFILE %s statement over generated bytes
+        
+        The infile path is bound before params. The load is committed (or,
+        with commit=False, left to the caller) only once every chunk was
+        produced and sent; returns the affected rows.
+        """
+        conn = self._get_connection()
+        try:
+            with _streamed_infile(chunks) as infile:
+                rowcount = self._run_sql(sql, (infile,) + params, commit=False)[2]
+            if commit:
+                conn.commit()
+            return rowcount
+        except Exception:
+            conn.rollback()
+            raise
+    
+    def _writes_ndjson(self, dataset: str) -> bool:
+        """Whether a dataset is loaded from NDJSON files (registry 'write_ndjson', default True)
+        
+        Datasets with write_ndjson: false are streamed from their JSON files
+        straight into stg_{dataset}_json by load_ndjson_to_staging.
+        """
+        dataset_config = self._dataset_config(dataset) or {}
+        return dataset_config.get('write_ndjson', True)
+    
+    def _stages_raw_json(self, dataset: str) -> bool:
+        """Whether a dataset keeps raw records in stg_{dataset}_json (registry 'stage_raw_json', default True)"""
+        dataset_config = self._dataset_config(dataset) or {}
+        return dataset_config.get('stage_raw_json', True)
+    
+    def convert_and_stage(self, dataset: str, since: str = None) -> int:
+        """Stream JSON files straight into the typed staging table
+        
+        Records are projected to the select_map columns in Python and bulk
+        loaded into stg_{dataset}, skipping the NDJSON files and
+        stg_{dataset}_json. Returns the number of rows staged.
+        """
+        logger.info(f"Starting fused convert and stage for {dataset}")
         
-        self._execute_sql(sql, (str(ndjson_file), file_name))
+        dataset_config = self._dataset_config(dataset)
+        if not dataset_config:
+            raise ValueError(f"Dataset {dataset} not found in registry")
+        
+        select_map = dataset_config.get('select_map', {})
+        if not select_map:
+            raise ValueError(f"No select_map defined for {dataset}")
+        
+        project = _compile_select_map(select_map)
+        if project is None:
+            raise ValueError(f"select_map of {dataset} uses expressions that only MySQL can evaluate")
+        
+        run_id = self._start_etl_run(f"Fused convert and stage: {dataset}")
+        
+        try:
+            self._create_staging_table(dataset)
+            self._execute_write(f"TRUNCATE TABLE stg_{dataset}")
+            
+            pointer = _compile_pointer(dataset_config.get('json_pointer', 'item'))
+            total_files = 0
+            total_rows = 0
+            total_errors = 0
+            
+            self._load_hash_cache()
+            for json_file in self._find_json_files(dataset, since):
+                started_at = datetime.now()
+                md5 = None
+                try:
+                    md5 = self._calculate_file_md5(json_file)
+                    rows_loaded = self._stage_single_json_file(dataset, json_file, pointer, select_map, project)
+                    
+                    self._record_etl_file(dataset, str(json_file), md5, rows_loaded, 'OK',
+                                          started_at=started_at)
+                    
+                    total_files += 1
+                    total_rows += rows_loaded
+                    
+                    logger.info(f"Staged {rows_loaded} rows from {json_file}")
+                
+                except Exception as e:
+                    total_errors += 1
+                    self._record_etl_file(dataset, str(json_file), md5, 0, 'ERROR', str(e),
+                                          started_at=started_at)
+                    logger.error(f"Error staging {json_file}: {e}")
+                
+                self._flush_full_etl_files()
+            
+            self._save_hash_cache()
+            self._end_etl_run('OK' if total_errors == 0 else 'PARTIAL', total_files, total_rows, total_errors)
+            return total_rows
+            
+        except Exception as e:
+            self._end_etl_run('ERROR', 0, 0, 1)
+            logger.error(f"Fused convert and stage failed for {dataset}: {e}")
+            raise
+        finally:
+            self._close_connection()
+    
+    def _stage_single_json_file(self, dataset: str, json_file: Path, pointer: JsonPointer,
+                                select_map: Dict[str, str], project: Callable[[Any], list]) -> int:
+        """Project one JSON file to TSV rows streamed by LOAD DATA into stg_{dataset}"""
+        rows = (_tsv_line(project(item)).encode('utf-8') for item in _iter_json_items(json_file, pointer))
         
-        # Count loaded rows
-        result = self._execute_sql(count_sql, (file_name,))
-        return result[0][0]
+        sql = f"""
+        LOAD DATA LOCAL INFILE %s
+        INTO TABLE stg_{dataset}
+        CHARACTER SET utf8mb4
+        FIELDS TERMINATED BY '\\t'
+        LINES TERMINATED BY '\\n'
+        ({', '.join(select_map)})
+        """
+        return self._load_local_stream(sql, rows)
     
     def upsert_staging_to_core(self, dataset: str = None, since: str = None, all_datasets: bool = False):
         """Upsert data from staging to core tables"""
@@ -364,49 +1082,47 @@ class IngestPipeline:
             self._close_connection()
     
     def _sort_datasets_by_dependencies(self, datasets: List[str]) -> List[str]:
-        """Sort datasets by dependencies (parents first)"""
-        registry = self.config.get_registry()
-        dataset_configs = registry.get('datasets', {})
+        """Sort datasets by dependencies (parents first) with Kahn's algorithm"""
+        indegree = dict.fromkeys(datasets, 0)
+        dependents = {dataset: [] for dataset in indegree}
+        for dataset in indegree:
+            config = self._dataset_config(dataset) or {}
+            # Dependencies outside our list do not constrain the order
+            for dep in set(config.get('depends_on', [])):
+                if dep in indegree:
+                    indegree[dataset] += 1
+                    dependents[dep].append(dataset)
         
         sorted_datasets = []
-        remaining = set(datasets)
-        
-        while remaining:
-            # Find datasets with no unresolved dependencies
-            ready = []
-            for dataset in remaining:
-                config = dataset_configs.get(dataset, {})
-                depends_on = config.get('depends_on', [])
-                
-                # Check if all dependencies are already processed or not in our list
-                unresolved_deps = [dep for dep in depends_on if dep in remaining]
-                if not unresolved_deps:
-                    ready.append(dataset)
-            
-            if not ready:
-                # Circular dependency or missing dependency
-                logger.warning(f"Circular dependency detected or missing dependency. Remaining: {remaining}")
-                sorted_datasets.extend(remaining)
-                break
-            
-            # Add ready datasets to sorted list
-            for dataset in ready:
-                sorted_datasets.append(dataset)
-                remaining.remove(dataset)
+        ready = deque(dataset for dataset, degree in indegree.items() if degree == 0)
+        while ready:
+            dataset = ready.popleft()
+            sorted_datasets.append(dataset)
+            for child in dependents[dataset]:
+                indegree[child] -= 1
+                if indegree[child] == 0:
+                    ready.append(child)
+        
+        if len(sorted_datasets) < len(indegree):
+            # Circular dependency: keep the rest in their original order
+            remaining = [dataset for dataset, degree in indegree.items() if degree > 0]
+            logger.warning(f"Circular dependency detected. Remaining: {remaining}")
+            sorted_datasets.extend(remaining)
         
         return sorted_datasets
     
     def _upsert_single_dataset(self, dataset: str) -> int:
         """Upsert a single dataset from staging to core"""
-        dataset_config = self.discovery.get_dataset_config(dataset)
+        dataset_config = self._dataset_config(dataset)
         if not dataset_config:
             raise ValueError(f"Dataset {dataset} not found in registry")
         
         # Create staging table if not exists
         self._create_staging_table(dataset)
         
-        # Project from JSON to staging table
-        self._project_json_to_staging(dataset)
+        # Project from JSON to staging table (fused datasets are staged directly)
+        if self._stages_raw_json(dataset):
+            self._project_json_to_staging(dataset)
         
         # Upsert from staging to core
         rows_upserted = self._upsert_staging_to_core_table(dataset)
@@ -415,7 +1131,7 @@ class IngestPipeline:
     
     def _create_staging_table(self, dataset: str):
         """Create staging table for dataset"""
-        dataset_config = self.discovery.get_dataset_config(dataset)
+        dataset_config = self._dataset_config(dataset)
         table_name = f"stg_{dataset}"
         
         # Build column definitions from select_map
@@ -426,11 +1142,11 @@ class IngestPipeline:
         if columns:
             columns_sql = ", ".join(columns)
             sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({columns_sql})"
-            self._execute_sql(sql)
+            self._execute_write(sql)
     
     def _project_json_to_staging(self, dataset: str):
         """Project data from JSON staging to typed staging table"""
-        dataset_config = self.discovery.get_dataset_config(dataset)
+        dataset_config = self._dataset_config(dataset)
         json_table = f"stg_{dataset}_json"
         staging_table = f"stg_{dataset}"
         
@@ -439,15 +1155,15 @@ class IngestPipeline:
             logger.warning(f"No select_map defined for {dataset}")
             return
         
-        # Build SELECT clause
-        select_clauses = []
-        for column, expression in select_map.items():
-            select_clauses.append(f"{expression} AS {column}")
-        
-        select_sql = ", ".join(select_clauses)
+        # Build SELECT clause: read generated columns when the JSON staging
+        # table has them, otherwise extract from the payload row by row
+        if self._ensure_generated_columns(dataset):
+            select_sql = ", ".join(select_map.keys())
+        else:
+            select_sql = ", ".join(f"{expression} AS {column}" for column, expression in select_map.items())
         
         # Clear staging table
-        self._execute_sql(f"TRUNCATE TABLE {staging_table}")
+        self._execute_write(f"TRUNCATE TABLE {staging_table}")
         
         # Insert projected data
         sql = f"""
@@ -455,11 +1171,11 @@ class IngestPipeline:
         SELECT {select_sql}
         FROM {json_table}
         """
-        self._execute_sql(sql)
+        self._execute_write(sql)
     
     def _upsert_staging_to_core_table(self, dataset: str) -> int:
         """Upsert data from staging to core table"""
-        dataset_config = self.discovery.get_dataset_config(dataset)
+        dataset_config = self._dataset_config(dataset)
         staging_table = f"stg_{dataset}"
         core_table = dataset_config['core_table']
         key_field = dataset_config['key']
@@ -473,7 +1189,7 @@ class IngestPipeline:
             update_sql = f"{key_field} = VALUES({key_field})"
         
         # Count rows before upsert
-        result = self._execute_sql(f"SELECT COUNT(*) FROM {staging_table}")
+        result = self._execute_read(f"SELECT COUNT(*) FROM {staging_table}")
         staging_count = result[0][0]
         
         if staging_count == 0:
@@ -487,7 +1203,7 @@ class IngestPipeline:
         ON DUPLICATE KEY UPDATE {update_sql}
         """
         
-        self._execute_sql(sql)
+        self._execute_write(sql)
         
         return staging_count
     
@@ -502,6 +1218,11 @@ class IngestPipeline:
             # Step 2: Load NDJSON to staging
             self.load_ndjson_to_staging(since=since, all_datasets=all_datasets)
             
+            # Datasets without raw JSON staging go straight from JSON to stg_{dataset}
+            for dataset_name in self.discovery.list_datasets():
+                if not self._stages_raw_json(dataset_name):
+                    self.convert_and_stage(dataset_name, since=since)
+            
             # Step 3: Upsert staging to core
             self.upsert_staging_to_core(since=since, all_datasets=all_datasets)
             
@@ -515,7 +1236,7 @@ class IngestPipeline:
         """Show ETL status and statistics"""
         try:
             # Show last run
-            result = self._execute_sql("""
+            result = self._execute_read("""
                 SELECT run_id, started_at, ended_at, status, total_files, total_rows, total_errors, notes
                 FROM etl_runs 
                 ORDER BY run_id DESC 
@@ -541,7 +1262,7 @@ class IngestPipeline:
             datasets = self.discovery.list_datasets()
             
             for dataset in datasets:
-                dataset_config = self.discovery.get_dataset_config(dataset)
+                dataset_config = self._dataset_config(dataset)
                 if not dataset_config:
                     continue
                 
@@ -553,13 +1274,13 @@ class IngestPipeline:
                     
                     # Check for pending records
                     for dep in depends_on:
-                        dep_config = self.discovery.get_dataset_config(dep)
+                        dep_config = self._dataset_config(dep)
                         if dep_config:
                             dep_table = dep_config['core_table']
                             dep_key = dep_config['key']
                             
                             # This is a simplified check - in reality you'd need to check FK relationships
-                            result = self._execute_sql(f"""
+                            result = self._execute_read(f"""
                                 SELECT COUNT(*) FROM {staging_table} s
                                 WHERE NOT EXISTS (
                                     SELECT 1 FROM {dep_table} c 
@@ -585,7 +1306,7 @@ class IngestPipeline:
         print(f"Configured datasets: {len(datasets)}")
         
         for dataset in datasets:
-            dataset_config = self.discovery.get_dataset_config(dataset)
+            dataset_config = self._dataset_config(dataset)
             if dataset_config:
                 print(f"\nDataset: {dataset}")
                 print(f"  Core table: {dataset_config['core_table']}")
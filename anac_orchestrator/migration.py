@@ -4,69 +4,403 @@ Database migration management for ANAC Orchestrator
 
 import logging
 import hashlib
+import mmap
+import os
+import queue
+import re
+import sys
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Iterator, Optional, Tuple
 import pymysql
 from datetime import datetime
 
 from .config import Config
+from .db_pool import connect, connection_kwargs
 
 logger = logging.getLogger(__name__)
 
+# Advisory lock serializing concurrent migrate_up runs against one database
+MIGRATION_LOCK_NAME = 'anac_orchestrator_migrations'
+MIGRATION_LOCK_TIMEOUT = 600
+
+# Scripts at least this large are read in the background while statements execute
+SCRIPT_STREAM_THRESHOLD = 1024 * 1024
+SCRIPT_READ_CHUNK_SIZE = 256 * 1024
+# Consecutive single-table INSERTs merged into one multi-row INSERT, at most this many at a time
+SCRIPT_INSERT_BATCH = 1000
+
+# ER_ALTER_OPERATION_NOT_SUPPORTED(_REASON): the requested ALGORITHM/LOCK is not possible
+ALTER_ALGORITHM_ERRORS = (1845, 1846)
+
+# Checksums recorded for the code-defined migrations
+V2_CHECKSUM_SOURCE = "migration_v2_fk_etl_indexes"
+V3_CHECKSUM_SOURCE = "migration_v3_etl_loaded_files"
+
+# Foreign keys to bando_cig added by migration v2: (table, constraint name)
+FOREIGN_KEYS = (
+    ("cup", "fk_cup_cig"),
+    ("stazioni_appaltanti", "fk_stazioni_appaltanti_cig"),
+    ("categorie_opera", "fk_categorie_opera_cig"),
+    ("categorie_dpcm_aggregazione", "fk_categorie_dpcm_aggregazione_cig"),
+    ("lavorazioni", "fk_lavorazioni_cig"),
+    ("partecipanti", "fk_partecipanti_cig"),
+    ("aggiudicazioni", "fk_aggiudicazioni_cig")
+)
+
+# Support indexes added by migration v2: (table, column)
+SUPPORT_INDEXES = (
+    ("bando_cig", "cf_amministrazione_appaltante"),
+    ("aggiudicazioni", "cig"),
+    ("aggiudicazioni", "id_aggiudicazione"),
+    ("partecipanti", "cig"),
+    ("aggiudicatari", "id_aggiudicazioni"),
+    ("subappalti", "id_aggiudicazione"),
+    ("stati_avanzamento", "id_aggiudicazione"),
+    ("varianti", "id_aggiudicazione"),
+    ("fine_contratto", "id_aggiudicazione"),
+    ("collaudo", "id_aggiudicazione"),
+    ("quadro_economico", "id_aggiudicazione"),
+    ("fonti_finanziamento", "id_aggiudicazione")
+)
+
+# Databases whose schema_version table this process already created: (host, port, database)
+_SCHEMA_VERSION_TABLES = set()
+
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+def _quote_identifier(name: str) -> str:
+    """Backtick-quote a table/column/constraint name for DDL, rejecting anything but plain identifiers"""
+    if not _IDENTIFIER_RE.match(name):
+        raise ValueError(f"Invalid SQL identifier: {name!r}")
+    return f"`{name}`"
+
+# Quoted strings, identifiers, executable (/*! */, /*+ */) and plain comments
+# (whose ';' do not end a statement), statement separators, and bare openers
+# of tokens still incomplete in the buffer
+_SQL_TOKEN_RE = re.compile(
+    r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`|/\*[!+].*?\*/|"""
+    r"""--[^\n]*\n|\#[^\n]*\n|/\*.*?\*/|;|['"`#]|--|/\*""",
+    re.S
+)
+_SQL_QUOTES = ("'", '"', '`')
+_SQL_OPENERS = _SQL_QUOTES + ('#', '--', '/*')
+
+def _is_sql_text(token: str) -> bool:
+    """Whether a complete token is statement text (quoted, or an executable comment) rather than a comment"""
+    return token[0] in _SQL_QUOTES or token[:3] in ('/*!', '/*+')
+
+def _iter_sql_statements(chunks: Iterator[str]) -> Iterator[str]:
+    """Split a SQL script read in chunks into statements, skipping comment-only ones"""
+    buf = ''
+    start = scan = 0
+    has_sql = False
+    final = False
+    while not final:
+        chunk = next(chunks, None)
+        final = chunk is None
+        if not final:
+            buf = buf[start:] + chunk
+            scan -= start
+            start = 0
+        
+        pos = scan
+        while True:
+            m = _SQL_TOKEN_RE.search(buf, pos)
+            if m is None:
+                # A trailing '-' or '/' outside any token may open a comment
+                # completed by the next chunk
+                end = len(buf)
+                if not final and buf[-1:] in ('-', '/') and pos < end:
+                    end -= 1
+                has_sql = has_sql or bool(buf[pos:end].strip())
+                pos = end
+                break
+            
+            has_sql = has_sql or bool(buf[pos:m.start()].strip())
+            token = m.group()
+            if token in _SQL_OPENERS:
+                if not final:
+                    # Unterminated string or comment: wait for more data
+                    pos = m.start()
+                    break
+                # At end of input an unterminated string is still SQL, a comment is not
+                has_sql = has_sql or token in _SQL_QUOTES
+                pos = len(buf)
+                break
+            
+            if token == ';':
+                if has_sql:
+                    yield buf[start:m.start()].strip()
+                start = m.end()
+                has_sql = False
+            elif _is_sql_text(token):
+                has_sql = True
+            pos = m.end()
+        scan = pos
+    
+    if has_sql:
+        yield buf[start:].strip()
+
+_SQL_STRING_RE = re.compile(r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`""", re.S)
+# Whitespace and plain comments before a statement (executable /*! */ and /*+ */ comments are kept)
+_LEADING_COMMENTS_RE = re.compile(r"(?:\s+|--[^\n]*\n|\#[^\n]*\n|/\*(?![!+]).*?\*/)*", re.S)
+_INSERT_LINE_RE = re.compile(r"^\s*INSERT\s", re.I | re.M)
+_INSERT_VALUES_RE = re.compile(r"INSERT\s+INTO\s+([\w`.]+)\s*(\([^()]*\))?\s*VALUES\s*(\(.*\))\Z", re.I | re.S)
+
+def _is_row_list(values: str) -> bool:
+    """Whether a VALUES tail holds only row tuples (no ON DUPLICATE KEY UPDATE or similar)"""
+    depth = 0
+    for char in _SQL_STRING_RE.sub("''", values):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth < 0:
+                return False
+        elif depth == 0 and char != ',' and not char.isspace():
+            return False
+    return depth == 0
+
+def _coalesce_inserts(statements: Iterator[str]) -> Iterator[str]:
+    """Merge runs of INSERT INTO t (cols) VALUES (...) statements into multi-row INSERTs"""
+    target = None
+    rows: List[str] = []
+    
+    def merged() -> str:
+        table, columns = target
+        return f"INSERT INTO {table}{' ' + columns if columns else ''} VALUES {', '.join(rows)}"
+    
+    for statement in statements:
+        m = _INSERT_VALUES_RE.match(statement, _LEADING_COMMENTS_RE.match(statement).end())
+        if m and _is_row_list(m.group(3)):
+            statement_target = (m.group(1), ' '.join((m.group(2) or '').split()))
+            if rows and (statement_target != target or len(rows) >= SCRIPT_INSERT_BATCH):
+                yield merged()
+                rows = []
+            target = statement_target
+            rows.append(m.group(3))
+            continue
+        
+        if rows:
+            yield merged()
+            rows = []
+        yield statement
+    
+    if rows:
+        yield merged()
+
+@lru_cache(maxsize=8)
+def _text_sha256(content: str) -> str:
+    """SHA256 of a string (UTF-8)"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+@lru_cache(maxsize=8)
+def _file_sha256(path: str, mtime_ns: int, size: int) -> str:
+    """SHA256 of a file; mtime_ns and size are part of the cache key so edits are re-hashed"""
+    with open(path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):
+            # Python 3.11+: chunked C-level read loop
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+        
+        file_hash = hashlib.sha256()
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                file_hash.update(mapped)
+        return file_hash.hexdigest()
+
+def _legacy_file_sha256(path: str) -> str:
+    """SHA256 of a file's UTF-8 text after universal-newline translation
+    
+    The v1 checksum older versions recorded; it differs from _file_sha256
+    for scripts checked out with CRLF line endings.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return hashlib.sha256(f.read().encode('utf-8')).hexdigest()
+
 class MigrationManager:
     """Manages database migrations for ANAC schema"""
     
     def __init__(self, config: Config):
         self.config = config
         self.connection = None
+        # Reused for every statement on the current connection
+        self._cursor = None
         
     def _get_connection(self):
-        """Get database connection"""
+        """Get database connection (from the pool of multi-statement connections)"""
         if not self.connection:
-            self.connection = pymysql.connect(
-                host=self.config.db_host,
-                port=self.config.db_port,
-                user=self.config.db_user,
-                password=self.config.db_password,
-                database=self.config.db_name,
-                charset='utf8mb4',
-                autocommit=False
-            )
+            self.connection = connect(self.config, multi_statements=True)
         return self.connection
     
+    def _get_cursor(self):
+        """Get the cursor shared by all statements on the current connection"""
+        if self._cursor is None:
+            self._cursor = self._get_connection().cursor()
+        return self._cursor
+    
     def _close_connection(self):
         """Close database connection"""
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
         if self.connection:
             self.connection.close()
             self.connection = None
     
-    def _execute_sql(self, sql: str, params: tuple = None) -> Any:
-        """Execute SQL statement"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
+    def _execute_sql(self, sql: str, params: tuple = None, commit: bool = False, fetch: bool = True) -> Any:
+        """Execute SQL statement, committing only when asked to
+        
+        Migration steps commit once at their end (see _commit_step), so
+        read-only probes and intermediate statements skip the COMMIT.
+        """
+        cursor = self._get_cursor()
         try:
             cursor.execute(sql, params)
-            result = cursor.fetchall()
-            conn.commit()
+            result = cursor.fetchall() if fetch else None
+            if commit:
+                self.connection.commit()
             return result
         except Exception as e:
-            conn.rollback()
             logger.error(f"SQL execution failed: {e}")
             raise
+    
+    @contextmanager
+    def _commit_step(self):
+        """Commit a migration step once at its end, rolling it back on error"""
+        conn = self._get_connection()
+        try:
+            yield
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    @contextmanager
+    def _bootstrap_session(self):
+        """Disable unique and foreign key checks while the bootstrap script runs
+        
+        Only meant for migration v1 on a fresh (non-production) database,
+        where there is no existing data to validate. The variables are
+        session scoped and restored before the pooled connection is reused.
+        """
+        self._execute_sql("SET SESSION unique_checks = 0, foreign_key_checks = 0", fetch=False)
+        try:
+            yield
         finally:
-            cursor.close()
+            self._execute_sql("SET SESSION unique_checks = 1, foreign_key_checks = 1", fetch=False)
     
-    def _get_schema_version(self) -> int:
-        """Get current schema version"""
+    def _execute_script(self, script: str):
+        """Execute a multi-statement SQL script in one round trip and commit once"""
+        if _INSERT_LINE_RE.search(script):
+            # Seed rows: one multi-row INSERT per run instead of one statement per row.
+            # The script is only rewritten when that actually merges statements;
+            # they may end in a line comment, so the ';' goes on its own line.
+            statements = list(_iter_sql_statements(iter((script,))))
+            merged = list(_coalesce_inserts(iter(statements)))
+            if len(merged) < len(statements):
+                script = "\n;\n".join(merged)
+        
+        cursor = self._get_cursor()
+        try:
+            with self._commit_step():
+                cursor.execute(script)
+                # Errors in later statements surface while advancing through the results
+                while cursor.nextset():
+                    pass
+        except Exception as e:
+            logger.error(f"SQL script execution failed: {e}")
+            raise
+    
+    def _execute_script_file(self, path: Path):
+        """Execute a large SQL script statement by statement while a background thread reads ahead
+        
+        Statements are committed once at the end, like _execute_script.
+        """
+        statements: queue.Queue = queue.Queue(maxsize=64)
+        stop = threading.Event()
+        
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    statements.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def read_statements():
+            try:
+                with open(path, 'r', encoding='utf-8', newline='') as f:
+                    chunks = iter(lambda: f.read(SCRIPT_READ_CHUNK_SIZE), '')
+                    for statement in _coalesce_inserts(_iter_sql_statements(chunks)):
+                        if not put(statement):
+                            return
+            except Exception as e:
+                put(e)
+                return
+            put(None)
+        
+        reader = threading.Thread(target=read_statements, name='migration-script-reader', daemon=True)
+        reader.start()
+        cursor = self._get_cursor()
+        count = 0
         try:
-            result = self._execute_sql("SELECT MAX(version) FROM schema_version")
-            return result[0][0] if result and result[0][0] else 0
-        except pymysql.Error:
-            # Table doesn't exist yet
-            return 0
+            with self._commit_step():
+                while True:
+                    statement = statements.get()
+                    if statement is None:
+                        break
+                    if isinstance(statement, Exception):
+                        raise statement
+                    cursor.execute(statement)
+                    count += 1
+            logger.info(f"Executed {count} statements from {path}")
+        except Exception as e:
+            logger.error(f"SQL script execution failed: {e}")
+            raise
+        finally:
+            stop.set()
+            reader.join()
+    
+    @contextmanager
+    def _migration_lock(self):
+        """Hold the MySQL advisory migration lock for the duration of the block
+        
+        GET_LOCK is session scoped, so the lock lives on its own unpooled
+        connection rather than one that could be handed to another caller.
+        """
+        lock_conn = pymysql.connect(**connection_kwargs(self.config))
+        try:
+            with lock_conn.cursor() as cursor:
+                logger.info(f"Waiting for migration lock {MIGRATION_LOCK_NAME}")
+                cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK_NAME, MIGRATION_LOCK_TIMEOUT))
+                acquired = cursor.fetchone()[0]
+            if acquired != 1:
+                raise RuntimeError(f"Could not acquire migration lock {MIGRATION_LOCK_NAME} "
+                                   f"within {MIGRATION_LOCK_TIMEOUT}s")
+            
+            try:
+                yield
+            finally:
+                with lock_conn.cursor() as cursor:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK_NAME,))
+        finally:
+            lock_conn.close()
+    
+    def _get_schema_version(self) -> int:
+        """Get current schema version (call _create_schema_version_table first)"""
+        result = self._execute_sql("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return result[0][0]
     
     def _create_schema_version_table(self):
-        """Create schema_version table if it doesn't exist"""
+        """Create schema_version table if it doesn't exist (once per database and process)"""
+        key = (self.config.db_host, self.config.db_port, self.config.db_name)
+        if key in _SCHEMA_VERSION_TABLES:
+            return
+        
         sql = """
         CREATE TABLE IF NOT EXISTS schema_version (
             version INT PRIMARY KEY,
@@ -75,7 +409,8 @@ class MigrationManager:
             notes TEXT
         )
         """
-        self._execute_sql(sql)
+        self._execute_sql(sql, commit=True)
+        _SCHEMA_VERSION_TABLES.add(key)
         logger.info("Created schema_version table")
     
     def _record_migration(self, version: int, checksum: str, notes: str):
@@ -88,11 +423,35 @@ class MigrationManager:
         checksum = VALUES(checksum),
         notes = VALUES(notes)
         """
-        self._execute_sql(sql, (version, checksum, notes))
+        self._execute_sql(sql, (version, checksum, notes), commit=True)
     
     def _calculate_checksum(self, content: str) -> str:
-        """Calculate SHA256 checksum of content"""
-        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+        """Calculate SHA256 checksum of content (memoized)"""
+        return _text_sha256(content)
+    
+    def _calculate_file_checksum(self, path: Path) -> str:
+        """Calculate SHA256 checksum of a file, hashing it again only after it changes"""
+        st = os.stat(path)
+        return _file_sha256(str(path), st.st_mtime_ns, st.st_size)
+    
+    def _applied_checksums(self) -> Dict[int, Optional[str]]:
+        """Get the checksum recorded for each applied migration version"""
+        result = self._execute_sql("SELECT version, checksum FROM schema_version")
+        return {row[0]: row[1] for row in result}
+    
+    def _check_applied(self, version: int, applied: Dict[int, Optional[str]], checksum: str,
+                       legacy_checksum: Optional[Callable[[], str]] = None):
+        """Log whether an applied migration still matches its current checksum
+        
+        legacy_checksum computes the checksum older versions recorded for the
+        same content; it is only called when checksum does not match.
+        """
+        recorded = applied.get(version)
+        if recorded == checksum or (legacy_checksum is not None and recorded == legacy_checksum()):
+            logger.info(f"Migration v{version} up to date, skipping")
+        else:
+            logger.warning(f"Migration v{version} changed since it was applied "
+                           f"(recorded checksum {applied.get(version)}); not re-applying")
     
     def migrate_v1(self):
         """Apply migration v1: Execute original TXT script"""
@@ -101,18 +460,20 @@ class MigrationManager:
         if not self.config.script_path.exists():
             raise FileNotFoundError(f"Script file not found: {self.config.script_path}")
         
-        with open(self.config.script_path, 'r', encoding='utf-8') as f:
-            script_content = f.read()
-        
-        checksum = self._calculate_checksum(script_content)
+        checksum = self._calculate_file_checksum(self.config.script_path)
         
         try:
-            # Split script into individual statements
-            statements = [stmt.strip() for stmt in script_content.split(';') if stmt.strip()]
-            
-            for statement in statements:
-                if statement:
-                    self._execute_sql(statement)
+            with self._bootstrap_session():
+                if self.config.script_path.stat().st_size >= SCRIPT_STREAM_THRESHOLD:
+                    # Large script: overlap reading the file with executing its statements
+                    self._execute_script_file(self.config.script_path)
+                else:
+                    # One binary read, decoded once (no text-mode newline translation pass)
+                    with open(self.config.script_path, 'rb') as f:
+                        script_content = f.read().decode('utf-8')
+                    
+                    # Sent as a single multi-statement batch instead of one call per statement
+                    self._execute_script(script_content)
             
             self._record_migration(1, checksum, "Original schema creation from TXT")
             logger.info("Migration v1 completed successfully")
@@ -129,13 +490,13 @@ class MigrationManager:
             # Create ETL tables
             self._create_etl_tables()
             
-            # Add foreign keys
-            self._add_foreign_keys()
-            
-            # Add indexes
-            self._add_indexes()
+            # Collect missing foreign keys and indexes, then apply them with one ALTER per table
+            pending_alters: Dict[str, List[Tuple[str, str]]] = {}
+            self._add_foreign_keys(pending_alters)
+            self._add_indexes(pending_alters)
+            self._apply_alters(pending_alters)
             
-            checksum = self._calculate_checksum("migration_v2_fk_etl_indexes")
+            checksum = self._calculate_checksum(V2_CHECKSUM_SOURCE)
             self._record_migration(2, checksum, "Added FK, ETL tables, and indexes")
             logger.info("Migration v2 completed successfully")
             
@@ -143,6 +504,55 @@ class MigrationManager:
             logger.error(f"Migration v2 failed: {e}")
             raise
     
+    def migrate_v3(self):
+        """Apply migration v3: etl_loaded_files, the loaded-file guard of the staging load"""
+        logger.info("Starting migration v3: etl_loaded_files")
+        
+        try:
+            with self._commit_step():
+                # One row per (dataset, staging file key), written in the same
+                # transaction as the file's LOAD DATA. Keys are hashed for the
+                # unique key, so paths of any length fit; etl_files keeps the
+                # full per-run history untouched.
+                self._execute_sql("""
+                    CREATE TABLE IF NOT EXISTS etl_loaded_files (
+                        loaded_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                        dataset VARCHAR(64) NOT NULL,
+                        file_key TEXT NOT NULL,
+                        file_key_sha256 CHAR(64) AS (SHA2(file_key, 256)) STORED,
+                        run_id BIGINT,
+                        md5 CHAR(32),
+                        rows_loaded BIGINT,
+                        loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        UNIQUE KEY uk_etl_loaded_files (dataset, file_key_sha256)
+                    )
+                """, fetch=False)
+                
+                # Seed it from successful staging loads recorded before v3
+                result = self._execute_sql("""
+                    SELECT f.dataset, f.path, f.run_id, f.md5, f.rows_loaded
+                    FROM etl_files f JOIN etl_runs r ON r.run_id = f.run_id
+                    WHERE f.status = 'OK' AND r.notes = 'NDJSON to staging load'
+                """)
+                rows = [
+                    (dataset, self.config.staging_file_key(path), run_id, md5, rows_loaded)
+                    for dataset, path, run_id, md5, rows_loaded in result
+                ]
+                if rows:
+                    self._get_cursor().executemany("""
+                        INSERT IGNORE INTO etl_loaded_files (dataset, file_key, run_id, md5, rows_loaded)
+                        VALUES (%s, %s, %s, %s, %s)
+                    """, rows)
+                    logger.info(f"Seeded etl_loaded_files with {len(rows)} earlier loads")
+            
+            checksum = self._calculate_checksum(V3_CHECKSUM_SOURCE)
+            self._record_migration(3, checksum, "Added etl_loaded_files")
+            logger.info("Migration v3 completed successfully")
+            
+        except Exception as e:
+            logger.error(f"Migration v3 failed: {e}")
+            raise
+    
     def _create_etl_tables(self):
         """Create ETL service tables"""
         etl_tables = {
@@ -188,122 +598,144 @@ class MigrationManager:
             """
         }
         
-        for table_name, sql in etl_tables.items():
-            self._execute_sql(sql)
-            logger.info(f"Created ETL table: {table_name}")
+        with self._commit_step():
+            for table_name, sql in etl_tables.items():
+                self._execute_sql(sql)
+                logger.info(f"Created ETL table: {table_name}")
     
-    def _add_foreign_keys(self):
-        """Add foreign keys to bando_cig"""
-        fk_definitions = [
-            ("cup", "fk_cup_cig"),
-            ("stazioni_appaltanti", "fk_stazioni_appaltanti_cig"),
-            ("categorie_opera", "fk_categorie_opera_cig"),
-            ("categorie_dpcm_aggregazione", "fk_categorie_dpcm_aggregazione_cig"),
-            ("lavorazioni", "fk_lavorazioni_cig"),
-            ("partecipanti", "fk_partecipanti_cig"),
-            ("aggiudicazioni", "fk_aggiudicazioni_cig")
-        ]
+    def _add_foreign_keys(self, pending_alters: Dict[str, List[Tuple[str, str]]]):
+        """Queue missing foreign keys to bando_cig as ALTER TABLE clauses"""
+        tables = tuple(table for table, _ in FOREIGN_KEYS)
+        constraint_names = tuple(constraint_name for _, constraint_name in FOREIGN_KEYS)
         
-        for table, constraint_name in fk_definitions:
-            try:
-                # Check if table exists and has cig column
-                result = self._execute_sql(f"""
-                    SELECT COUNT(*) FROM information_schema.columns 
-                    WHERE table_schema = DATABASE() 
-                    AND table_name = '{table}' 
-                    AND column_name = 'cig'
-                """)
-                
-                if result[0][0] > 0:
-                    # Check if FK already exists
-                    fk_check = self._execute_sql(f"""
-                        SELECT COUNT(*) FROM information_schema.key_column_usage 
-                        WHERE table_schema = DATABASE() 
-                        AND table_name = '{table}' 
-                        AND constraint_name = '{constraint_name}'
-                    """)
-                    
-                    if fk_check[0][0] == 0:
-                        sql = f"""
-                            ALTER TABLE {table} 
-                            ADD CONSTRAINT {constraint_name}
-                            FOREIGN KEY (cig) REFERENCES bando_cig(cig)
-                        """
-                        self._execute_sql(sql)
-                        logger.info(f"Added FK: {constraint_name}")
-                    else:
-                        logger.info(f"FK already exists: {constraint_name}")
-                else:
-                    logger.warning(f"Table {table} does not have cig column, skipping FK")
-                    
-            except Exception as e:
-                logger.warning(f"Could not add FK {constraint_name}: {e}")
+        with self._commit_step():
+            # Two bulk probes instead of two queries per table
+            result = self._execute_sql("""
+                SELECT table_name FROM information_schema.columns
+                WHERE table_schema = DATABASE()
+                AND table_name IN %s
+                AND column_name = 'cig'
+            """, (tables,))
+            has_cig = {row[0] for row in result}
+            
+            result = self._execute_sql("""
+                SELECT table_name, constraint_name FROM information_schema.key_column_usage
+                WHERE table_schema = DATABASE()
+                AND table_name IN %s
+                AND constraint_name IN %s
+            """, (tables, constraint_names))
+            existing_fks = {(row[0], row[1]) for row in result}
+        
+        for table, constraint_name in FOREIGN_KEYS:
+            if table not in has_cig:
+                logger.warning(f"Table {table} does not have cig column, skipping FK")
+            elif (table, constraint_name) in existing_fks:
+                logger.info(f"FK already exists: {constraint_name}")
+            else:
+                # Identifiers cannot be bound as parameters
+                clause = (f"ADD CONSTRAINT {_quote_identifier(constraint_name)} "
+                          f"FOREIGN KEY (cig) REFERENCES bando_cig(cig)")
+                pending_alters.setdefault(table, []).append((clause, f"FK {constraint_name}"))
     
-    def _add_indexes(self):
-        """Add support indexes"""
-        indexes = [
-            ("bando_cig", "cf_amministrazione_appaltante"),
-            ("aggiudicazioni", "cig"),
-            ("aggiudicazioni", "id_aggiudicazione"),
-            ("partecipanti", "cig"),
-            ("aggiudicatari", "id_aggiudicazioni"),
-            ("subappalti", "id_aggiudicazione"),
-            ("stati_avanzamento", "id_aggiudicazione"),
-            ("varianti", "id_aggiudicazione"),
-            ("fine_contratto", "id_aggiudicazione"),
-            ("collaudo", "id_aggiudicazione"),
-            ("quadro_economico", "id_aggiudicazione"),
-            ("fonti_finanziamento", "id_aggiudicazione")
-        ]
+    def _add_indexes(self, pending_alters: Dict[str, List[Tuple[str, str]]]):
+        """Queue missing support indexes as ALTER TABLE clauses"""
+        tables = tuple(dict.fromkeys(table for table, _ in SUPPORT_INDEXES))
         
-        for table, column in indexes:
-            try:
-                index_name = f"idx_{table}_{column}"
-                
-                # Check if index already exists
-                result = self._execute_sql(f"""
-                    SELECT COUNT(*) FROM information_schema.statistics 
-                    WHERE table_schema = DATABASE() 
-                    AND table_name = '{table}' 
-                    AND index_name = '{index_name}'
-                """)
+        with self._commit_step():
+            # Two bulk probes instead of two queries per index
+            result = self._execute_sql("""
+                SELECT DISTINCT table_name, index_name FROM information_schema.statistics
+                WHERE table_schema = DATABASE()
+                AND table_name IN %s
+            """, (tables,))
+            existing_indexes = {(row[0], row[1]) for row in result}
+            
+            result = self._execute_sql("""
+                SELECT table_name, column_name FROM information_schema.columns
+                WHERE table_schema = DATABASE()
+                AND table_name IN %s
+            """, (tables,))
+            existing_columns = {(row[0], row[1]) for row in result}
+        
+        for table, column in SUPPORT_INDEXES:
+            index_name = f"idx_{table}_{column}"
+            
+            if (table, index_name) in existing_indexes:
+                logger.info(f"Index already exists: {index_name}")
+            elif (table, column) not in existing_columns:
+                logger.warning(f"Column {table}.{column} does not exist, skipping index")
+            else:
+                clause = f"ADD INDEX {_quote_identifier(index_name)} ({_quote_identifier(column)})"
+                pending_alters.setdefault(table, []).append((clause, f"index {index_name}"))
+    
+    def _apply_alters(self, pending_alters: Dict[str, List[Tuple[str, str]]]):
+        """Apply queued (clause, label) changes with a single online ALTER TABLE per table
+        
+        One ALTER takes the table's metadata lock once instead of once per
+        constraint/index. If it fails (e.g. one FK is violated) the clauses
+        are applied one by one, so a single bad change does not block the others.
+        """
+        with self._commit_step():
+            for table, clauses in pending_alters.items():
+                try:
+                    self._alter_table_online(table, [clause for clause, _ in clauses])
+                    for _, label in clauses:
+                        logger.info(f"Added {label}")
+                    continue
+                except Exception as e:
+                    logger.warning(f"Combined ALTER TABLE {table} failed, applying changes one by one: {e}")
                 
-                if result[0][0] == 0:
-                    # Check if table and column exist
-                    col_check = self._execute_sql(f"""
-                        SELECT COUNT(*) FROM information_schema.columns 
-                        WHERE table_schema = DATABASE() 
-                        AND table_name = '{table}' 
-                        AND column_name = '{column}'
-                    """)
-                    
-                    if col_check[0][0] > 0:
-                        sql = f"CREATE INDEX {index_name} ON {table} ({column})"
-                        self._execute_sql(sql)
-                        logger.info(f"Created index: {index_name}")
-                    else:
-                        logger.warning(f"Column {table}.{column} does not exist, skipping index")
-                else:
-                    logger.info(f"Index already exists: {index_name}")
-                    
-            except Exception as e:
-                logger.warning(f"Could not create index {table}.{column}: {e}")
+                for clause, label in clauses:
+                    try:
+                        self._alter_table_online(table, [clause])
+                        logger.info(f"Added {label}")
+                    except Exception as e:
+                        logger.warning(f"Could not add {label}: {e}")
+    
+    def _alter_table_online(self, table: str, clauses: List[str]):
+        """ALTER TABLE with ALGORITHM=INPLACE, LOCK=NONE so DML continues during the change
+        
+        Falls back to the server's default algorithm when the change cannot
+        be made online (e.g. adding an FK while foreign_key_checks=1).
+        """
+        sql = f"ALTER TABLE {_quote_identifier(table)} {', '.join(clauses)}"
+        try:
+            self._execute_sql(f"{sql}, ALGORITHM=INPLACE, LOCK=NONE", fetch=False)
+        except pymysql.err.OperationalError as e:
+            if e.args[0] not in ALTER_ALGORITHM_ERRORS:
+                raise
+            logger.warning(f"ALTER TABLE {table} cannot run online, retrying with default algorithm: {e}")
+            self._execute_sql(sql, fetch=False)
     
     def migrate_up(self):
         """Apply all pending migrations"""
         logger.info("Starting migration process")
         
         try:
-            self._create_schema_version_table()
-            current_version = self._get_schema_version()
-            
-            if current_version < 1:
-                self.migrate_v1()
-                current_version = 1
-            
-            if current_version < 2:
-                self.migrate_v2()
-                current_version = 2
+            # A concurrent runner waits here, then finds the migrations applied
+            with self._migration_lock():
+                self._create_schema_version_table()
+                applied = self._applied_checksums()
+                current_version = max(applied, default=0)
+                
+                if current_version < 1:
+                    self.migrate_v1()
+                    current_version = 1
+                elif self.config.script_path.exists():
+                    self._check_applied(1, applied, self._calculate_file_checksum(self.config.script_path),
+                                        lambda: _legacy_file_sha256(str(self.config.script_path)))
+                
+                if current_version < 2:
+                    self.migrate_v2()
+                    current_version = 2
+                else:
+                    self._check_applied(2, applied, self._calculate_checksum(V2_CHECKSUM_SOURCE))
+                
+                if current_version < 3:
+                    self.migrate_v3()
+                    current_version = 3
+                else:
+                    self._check_applied(3, applied, self._calculate_checksum(V3_CHECKSUM_SOURCE))
             
             logger.info(f"Migration completed. Current version: {current_version}")
             
@@ -322,13 +754,15 @@ class MigrationManager:
             print(f"Current schema version: {current_version}")
             
             # Show migration history
-            result = self._execute_sql("SELECT * FROM schema_version ORDER BY version")
+            result = self._execute_sql(
+                "SELECT version, applied_at, checksum, notes FROM schema_version ORDER BY version"
+            )
             if result:
-                print("\nMigration history:")
-                print("Version | Applied At | Checksum | Notes")
-                print("-" * 80)
-                for row in result:
-                    print(f"{row[0]:7} | {row[1]} | {row[2][:16]}... | {row[3]}")
+                lines = ["\nMigration history:", "Version | Applied At | Checksum | Notes", "-" * 80]
+                lines.extend(
+                    f"{row[0]:7} | {row[1]} | {str(row[2])[:16]}... | {row[3]}" for row in result
+                )
+                sys.stdout.write("\n".join(lines) + "\n")
             else:
                 print("No migrations applied yet")
                 
@@ -5,8 +5,20 @@ Create sample JSON data for testing ANAC Orchestrator
 
 import json
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _dumps(data) -> bytes:
+    """Serialize sample records as indented UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+
 def create_sample_bando_cig():
     """Create sample bando_cig data"""
     data = [
@@ -112,6 +124,16 @@ def create_sample_cup():
     ]
     return data
 
+def _emit(dataset_name, data, base_path: Path, today: str):
+    """Create one dataset folder and its JSON file"""
+    folder_name = f"{today}-{dataset_name}_json"
+    folder_path = base_path / folder_name
+    folder_path.mkdir(exist_ok=True)
+    
+    json_file = folder_path / f"{dataset_name}.json"
+    json_file.write_bytes(_dumps(data))
+    return json_file, len(data)
+
 def main():
     """Create sample data structure"""
     print("Creating sample JSON data for ANAC Orchestrator...")
@@ -130,18 +152,15 @@ def main():
         "cup": create_sample_cup()
     }
     
-    for dataset_name, data in datasets.items():
-        # Create folder
-        folder_name = f"{today}-{dataset_name}_json"
-        folder_path = base_path / folder_name
-        folder_path.mkdir(exist_ok=True)
-        
-        # Create JSON file
-        json_file = folder_path / f"{dataset_name}.json"
-        with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        
-        print(f"Created: {json_file} ({len(data)} records)")
+    # Folders are independent: create and write them concurrently
+    with ThreadPoolExecutor(max_workers=min(8, len(datasets))) as executor:
+        created = list(executor.map(
+            lambda item: _emit(item[0], item[1], base_path, today),
+            datasets.items()
+        ))
+    
+    for json_file, count in created:
+        print(f"Created: {json_file} ({count} records)")
     
     print(f"\nSample data created successfully!")
     print(f"Total datasets: {len(datasets)}")
@@ -32,6 +32,12 @@ setup(
     ],
     python_requires=">=3.8",
     install_requires=requirements,
+    extras_require={
+        # Optional speedups, used automatically when installed
+        "pool": ["DBUtils>=3.0"],
+        "speedups": ["orjson>=3.9", "ijson>=3.2", "xxhash>=3.4"],
+        "all": ["DBUtils>=3.0", "orjson>=3.9", "ijson>=3.2", "xxhash>=3.4"],
+    },
     entry_points={
         "console_scripts": [
             "anac-etl=anac_orchestrator.cli:main",
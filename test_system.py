@@ -3,53 +3,70 @@
 Test script for ANAC Orchestrator
 """
 
+import copy
 import os
 import sys
 import tempfile
-import shutil
+import threading
+from functools import lru_cache
 from pathlib import Path
 
 # Add the current directory to Python path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from anac_orchestrator.config import Config
-from anac_orchestrator.discovery import DatasetDiscovery
+from anac_orchestrator.discovery import DatasetDiscovery, _classify_dataset_folder
+
+# Config files written by the tests go here, not to the working tree's config/
+_CONFIG_DIR = tempfile.TemporaryDirectory(prefix='anac_test_config_')
+
+@lru_cache(maxsize=None)
+def shared_config() -> Config:
+    """Config built once and shared by the tests, on a temporary config path"""
+    return Config(os.path.join(_CONFIG_DIR.name, 'anac_etl.yml'))
 
 def test_config():
     """Test configuration management"""
     print("Testing Configuration...")
     
-    # Create temporary directory
-    temp_dir = Path(tempfile.mkdtemp())
+    # Test config creation
+    config = shared_config()
+    print(f"✓ Config created successfully")
+    print(f"  - JSON root: {config.json_root}")
+    print(f"  - NDJSON root: {config.ndjson_root}")
+    print(f"  - Logs root: {config.logs_root}")
     
-    try:
-        # Test config creation
-        config = Config()
-        print(f"✓ Config created successfully")
-        print(f"  - JSON root: {config.json_root}")
-        print(f"  - NDJSON root: {config.ndjson_root}")
-        print(f"  - Logs root: {config.logs_root}")
-        
-        # Test registry operations
-        test_registry = {
-            'datasets': {
-                'test_dataset': {
-                    'name': 'test_dataset',
-                    'core_table': 'test_table'
-                }
+    # Test registry operations
+    test_registry = {
+        'datasets': {
+            'test_dataset': {
+                'name': 'test_dataset',
+                'core_table': 'test_table'
             }
         }
+    }
+    
+    config.update_registry(test_registry)
+    print("✓ Registry updated successfully")
+    
+    retrieved_registry = config.get_registry()
+    assert 'test_dataset' in retrieved_registry['datasets']
+    print("✓ Registry retrieval works correctly")
+    
+    # The JSON copy wins unless the YAML file was edited after it
+    with tempfile.TemporaryDirectory() as td:
+        config_path = os.path.join(td, 'anac_etl.yml')
+        exported = Config(config_path)
+        exported.config = {'registry': {'datasets': {}}, 'source': 'json'}
+        exported.save_yaml()
+        assert Config(config_path).config['source'] == 'json'
         
-        config.update_registry(test_registry)
-        print("✓ Registry updated successfully")
-        
-        retrieved_registry = config.get_registry()
-        assert 'test_dataset' in retrieved_registry['datasets']
-        print("✓ Registry retrieval works correctly")
-        
-    finally:
-        # Cleanup
-        shutil.rmtree(temp_dir, ignore_errors=True)
+        with open(config_path, 'w', encoding='utf-8') as f:
+            f.write("source: edited\n")
+        json_mtime = os.stat(exported.json_config_path).st_mtime_ns
+        os.utime(config_path, ns=(json_mtime + 10**9, json_mtime + 10**9))
+        assert Config(config_path).config['source'] == 'edited'
+    print("✓ Newer YAML edits are not shadowed by the JSON copy")
     
     print("Configuration test passed!\n")
 
@@ -58,11 +75,11 @@ def test_discovery():
     print("Testing Dataset Discovery...")
     
     # Create temporary directory structure
-    temp_dir = Path(tempfile.mkdtemp())
-    json_root = temp_dir / "JSON"
-    json_root.mkdir()
-    
-    try:
+    with tempfile.TemporaryDirectory() as td:
+        temp_dir = Path(td)
+        json_root = temp_dir / "JSON"
+        json_root.mkdir()
+        
         # Create sample dataset folders
         sample_folders = [
             "20240201-bando_cig_json",
@@ -78,8 +95,8 @@ def test_discovery():
             sample_file = folder_path / "sample.json"
             sample_file.write_text('{"test": "data"}')
         
-        # Test discovery with temporary config
-        config = Config()
+        # Test discovery with a copy of the shared config (json_root is changed)
+        config = copy.copy(shared_config())
         config.json_root = json_root
         
         discovery = DatasetDiscovery(config)
@@ -90,6 +107,18 @@ def test_discovery():
         assert 'aggiudicazioni' in predefined
         print("✓ Predefined datasets loaded correctly")
         
+        # Test folder name classification
+        assert _classify_dataset_folder('20240201-aggiudicazioni_json') == ('aggiudicazioni', True)
+        assert _classify_dataset_folder('20240201-unknown_dataset_json') == ('unknown_dataset', False)
+        assert _classify_dataset_folder('20240201-foo-bar_json') == ('foo-bar', False)
+        assert _classify_dataset_folder('20240201-cig_json') == ('cig', True)
+        assert _classify_dataset_folder('20240201-x-cig_json') == ('x-cig', False)
+        assert _classify_dataset_folder('20240201-_json') is None
+        assert _classify_dataset_folder('2024ab01-cig_json') is None
+        assert _classify_dataset_folder('20240201_cig_json') is None
+        assert _classify_dataset_folder('20240201-cig') is None
+        print("✓ Folder names classified correctly")
+        
         # Test discovery
         registry = discovery.discover_datasets()
         
@@ -109,10 +138,6 @@ def test_discovery():
         unknown_names = [d['name'] for d in unknown_datasets]
         print(f"Unknown datasets found: {unknown_names}")
         print("✓ Unknown datasets identified correctly")
-        
-    finally:
-        # Cleanup
-        shutil.rmtree(temp_dir, ignore_errors=True)
     
     print("Discovery test passed!\n")
 
@@ -137,6 +162,181 @@ def test_cli_imports():
     print("CLI imports test passed!\n")
     return True
 
+def _split_sql(script, chunk_size):
+    """Split script into statements, feeding it in chunks of chunk_size characters"""
+    from anac_orchestrator.migration import _iter_sql_statements
+    chunks = iter([script[i:i + chunk_size] for i in range(0, len(script), chunk_size)])
+    return list(_iter_sql_statements(chunks))
+
+def test_sql_splitter():
+    """Test splitting migration scripts into statements"""
+    print("Testing SQL Script Splitter...")
+    
+    script = (
+        "/*!40101 SET NAMES utf8mb4 */;\n"
+        "/*!40014 SET FOREIGN_KEY_CHECKS=0 */;\n"
+        "-- comment; not a statement\n"
+        "CREATE TABLE `we;ird` (a INT, b TEXT);\n"
+        "# hash comment;\n"
+        "INSERT INTO `we;ird` VALUES (1, 'x;y'), (2, \"q;\\\"z\"), (3, 'it''s;');\n"
+        "/* block; comment */;\n"
+        "SELECT 1 - 2 /*+ MAX_EXECUTION_TIME(1) */;\n"
+        "UPDATE t SET a = 1 -- trailing comment"
+    )
+    expected = [
+        "/*!40101 SET NAMES utf8mb4 */",
+        "/*!40014 SET FOREIGN_KEY_CHECKS=0 */",
+        "-- comment; not a statement\nCREATE TABLE `we;ird` (a INT, b TEXT)",
+        "# hash comment;\nINSERT INTO `we;ird` VALUES (1, 'x;y'), (2, \"q;\\\"z\"), (3, 'it''s;')",
+        "SELECT 1 - 2 /*+ MAX_EXECUTION_TIME(1) */",
+        "UPDATE t SET a = 1 -- trailing comment"
+    ]
+    assert _split_sql(script, len(script)) == expected
+    print("✓ Quoted ';', backticks, comments and executable comments split correctly")
+    
+    # Every chunk boundary gives the same statements as the whole script
+    for chunk_size in range(1, len(script)):
+        assert _split_sql(script, chunk_size) == expected, chunk_size
+    print("✓ Output independent of chunk boundaries")
+    
+    assert _split_sql("-- only a comment", 4) == []
+    assert _split_sql("/* only a comment */;\n;", 3) == []
+    assert _split_sql("SELECT 'unterminated", 5) == ["SELECT 'unterminated"]
+    print("✓ Comment-only and unterminated input handled")
+    
+    print("SQL splitter test passed!\n")
+
+def test_insert_coalescing():
+    """Test merging runs of seed INSERTs in migration scripts"""
+    print("Testing INSERT Coalescing...")
+    
+    from anac_orchestrator.migration import _coalesce_inserts, _is_row_list
+    
+    assert _is_row_list("(1, 'a'), (2, NOW())")
+    assert _is_row_list("(1, 'it''s'), (2, ');(')")
+    assert not _is_row_list("(1, 'a') ON DUPLICATE KEY UPDATE b = VALUES(b)")
+    assert not _is_row_list("(1, 'a')) x (")
+    print("✓ Row lists recognized")
+    
+    statements = [
+        "/*!40101 SET NAMES utf8mb4 */",
+        "INSERT INTO t (a, b) VALUES (1, 'it''s;')",
+        "-- seed\nINSERT INTO t (a,  b) VALUES (2, 'x;)')",
+        "INSERT INTO t (a, b) VALUES (3, 'y') -- trailing comment",
+        "INSERT INTO t (a, b) VALUES (4, 'q') ON DUPLICATE KEY UPDATE b = VALUES(b)",
+        "INSERT INTO u VALUES (1)",
+        "INSERT INTO u VALUES (2)",
+        "INSERT INTO v (a) SELECT a FROM u",
+        "/*!40000 INSERT INTO u VALUES (3) */"
+    ]
+    assert list(_coalesce_inserts(iter(statements))) == [
+        "/*!40101 SET NAMES utf8mb4 */",
+        "INSERT INTO t (a, b) VALUES (1, 'it''s;'), (2, 'x;)')",
+        "INSERT INTO t (a, b) VALUES (3, 'y') -- trailing comment",
+        "INSERT INTO t (a, b) VALUES (4, 'q') ON DUPLICATE KEY UPDATE b = VALUES(b)",
+        "INSERT INTO u VALUES (1), (2)",
+        "INSERT INTO v (a) SELECT a FROM u",
+        "/*!40000 INSERT INTO u VALUES (3) */"
+    ]
+    print("✓ Only plain INSERT ... VALUES runs are merged")
+    
+    print("INSERT coalescing test passed!\n")
+
+def _run_with_timeout(func, timeout: float = 30):
+    """Run func in a thread, failing instead of hanging if it does not return in time"""
+    outcome = {}
+    
+    def target():
+        try:
+            outcome['value'] = func()
+        except Exception as e:
+            outcome['error'] = e
+    
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), f"{func.__name__} did not return within {timeout}s"
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('value')
+
+def test_streamed_infile():
+    """Test feeding generated LOAD DATA input through a named pipe"""
+    print("Testing Streamed LOAD DATA Input...")
+    
+    from anac_orchestrator.ingest import _streamed_infile
+    
+    def big_stream():
+        # Far more than a pipe buffer holds
+        for _ in range(1000):
+            yield b'x' * 100_000
+    
+    def full_read():
+        with _streamed_infile(iter([b'a\n', b'b\n'])) as path:
+            with open(path, 'rb') as f:
+                return f.read()
+    
+    assert _run_with_timeout(full_read) == b'a\nb\n'
+    print("✓ Reader receives every chunk")
+    
+    def no_reader():
+        with _streamed_infile(big_stream()):
+            pass
+    
+    _run_with_timeout(no_reader)
+    print("✓ Unopened pipe does not block")
+    
+    def partial_reader():
+        with _streamed_infile(big_stream()) as path:
+            with open(path, 'rb') as f:
+                return f.read(10)
+    
+    assert _run_with_timeout(partial_reader) == b'x' * 10
+    print("✓ Reader stopping partway does not block")
+    
+    def failing_stream():
+        yield b'a\n'
+        raise ValueError("bad record")
+    
+    def producer_error():
+        with _streamed_infile(failing_stream()) as path:
+            with open(path, 'rb') as f:
+                f.read()
+    
+    try:
+        _run_with_timeout(producer_error)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("producer error was not re-raised")
+    print("✓ Producer errors are re-raised")
+    
+    print("Streamed LOAD DATA input test passed!\n")
+
+def test_select_projection():
+    """Test projecting records to LOAD DATA rows in Python"""
+    print("Testing Select Map Projection...")
+    
+    from anac_orchestrator.ingest import _compile_select_map, _tsv_line
+    
+    field = 'JSON_UNQUOTE(JSON_EXTRACT(payload, "$.{}"))'.format
+    project = _compile_select_map({
+        'cig': field('cig'),
+        'importo': f"CAST({field('importo')} AS DOUBLE)",
+        'id_aggiudicazione': f"CAST({field('id_aggiudicazione')} AS SIGNED)",
+        'data': f'STR_TO_DATE({field("data")}, "%Y-%m-%d")'
+    })
+    assert project({'cig': 'A\t1', 'importo': 1.5, 'id_aggiudicazione': '7', 'data': '2024-02-01T10:00'}) == \
+        ['A\t1', '1.5', '7', '2024-02-01']
+    assert project({'cig': None, 'importo': 'n/a', 'data': 'soon'}) == ['null', None, None, None]
+    assert _compile_select_map({'x': 'UPPER(payload)'}) is None
+    print("✓ Records projected like the MySQL expressions")
+    
+    assert _tsv_line(['a\tb', None, 'c\\d\ne']) == 'a\\tb\t\\N\tc\\\\d\\ne\n'
+    print("✓ TSV lines escaped for LOAD DATA")
+    
+    print("Select map projection test passed!\n")
+
 def main():
     """Run all tests"""
     print("ANAC Orchestrator - System Tests")
@@ -146,6 +346,10 @@ def main():
         test_config()
         test_discovery()
         test_cli_imports()
+        test_sql_splitter()
+        test_insert_coalescing()
+        test_streamed_infile()
+        test_select_projection()
         
         print("All tests passed! ✓")
         print("\nThe ANAC Orchestrator is ready to use.")